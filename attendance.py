@@ -0,0 +1,103 @@
+import clients
+import concert_lists
+import constants
+import upcoming
+
+
+# One attendance row per (user, concert), keyed "<user_id>:<concert_id>", copying
+# the concert's band, date, venue and address along with the user's entity key.
+# A user's upcoming concerts are a cursor query on (user_id, sort_date), and a
+# concert's or band's attendees a query on concert_id or band_id. Rows are
+# written after the user's concert list changes and kept in step when a concert
+# is edited or deleted.
+ds_client = clients.ds_client
+unindexed = ("user_key", "venue", "address", "date")
+
+
+def row_key(user_id, concert_id):
+    return ds_client.key(constants.attendance, f"{user_id}:{int(concert_id)}")
+
+
+def build_row(user_key, user_id, concert):
+    row = clients.new_entity(key=row_key(user_id, concert.key.id), exclude_from_indexes=unindexed)
+    row.update({
+        "user_id": user_id,
+        "user_key": user_key,
+        "concert_id": concert.key.id,
+        "band_id": int(concert["band"]["id"]),
+        "sort_date": upcoming.concert_sort_date(concert),
+        "venue": concert["venue"],
+        "address": concert["address"],
+        "date": concert["date"]
+    })
+    return row
+
+
+def add(user, concert_ids):
+    concert_keys = [ds_client.key(constants.concert, int(cid)) for cid in concert_ids]
+    clients.put_multi([
+        build_row(user.key, user["user_id"], concert) for concert in clients.get_multi(concert_keys)
+    ])
+
+
+def remove(user, concert_ids):
+    clients.delete_multi([row_key(user["user_id"], cid) for cid in concert_ids])
+
+
+def concert_rows(concert_id):
+    query = ds_client.query(kind=constants.attendance)
+    query.add_filter("concert_id", "=", int(concert_id))
+    return list(query.fetch())
+
+
+def update_concert(concert):
+    # Copy edited concert details into every attendee's row
+    clients.put_multi([
+        build_row(row["user_key"], row["user_id"], concert) for row in concert_rows(concert.key.id)
+    ])
+
+
+def attendees(concert_id):
+    # User entities attending the concert
+    return clients.get_multi([row["user_key"] for row in concert_rows(concert_id)])
+
+
+def band_user_ids(band_id):
+    # Ids of users attending any concert by the band
+    query = ds_client.query(kind=constants.attendance)
+    query.add_filter("band_id", "=", int(band_id))
+    query.keys_only()
+    return set(row.key.name.rsplit(":", 1)[0] for row in query.fetch())
+
+
+def remove_concert(concert_id):
+    query = ds_client.query(kind=constants.attendance)
+    query.add_filter("concert_id", "=", int(concert_id))
+    query.keys_only()
+    clients.delete_multi([row.key for row in query.fetch()])
+
+
+def rebuild_user(user):
+    # Recompute a user's rows from their concert list and drop stale ones
+    concert_ids = set(concert_lists.get_concert_ids(user))
+    query = ds_client.query(kind=constants.attendance)
+    query.add_filter("user_id", "=", user["user_id"])
+    query.keys_only()
+    clients.delete_multi([row.key for row in query.fetch()
+                          if int(row.key.name.rsplit(":", 1)[1]) not in concert_ids])
+    add(user, concert_ids)
+    return len(concert_ids)
+
+
+def fetch_upcoming(user_id, limit, cursor=None):
+    query = ds_client.query(kind=constants.attendance)
+    query.add_filter("user_id", "=", user_id)
+    query.add_filter("sort_date", ">=", upcoming.today())
+    query.order = ["sort_date"]
+    q_result = query.fetch(limit=limit, start_cursor=cursor)
+    rows = list(next(q_result.pages))
+    return rows, q_result.next_page_token
+
+
+def format_row(row, host_url):
+    return upcoming.format_entry(row, host_url, row["concert_id"])
@@ -1,10 +1,18 @@
 from flask import Blueprint, request, make_response
-from google.cloud import datastore
 import json
+import attendance
+import changes
+import clients
+import concert_lists
 import constants
+import idempotency
+import search
+import snapshots
+import stats
+import upcoming
 
 
-ds_client = datastore.Client()
+ds_client = clients.ds_client
 bp = Blueprint('bands', __name__, url_prefix='/bands')
 pg_limit = 5
 
@@ -96,8 +104,8 @@ def update_new_band(band, req_body):
     updates["name"] = req_body["name"]
     updates["genre"] = req_body["genre"]
     updates["members"] = req_body["members"]
-    updates["concerts"] = []
     band.update(updates)
+    concert_lists.init_concert_ids(band)
 
 
 def update_band_details(band, req_body):
@@ -111,14 +119,16 @@ def update_band_details(band, req_body):
     band.update(updates)
 
 
+def band_change_data(band):
+    return {"name": band["name"], "genre": band["genre"], "members": band["members"]}
+
+
 def remove_concert_from_all_users(concert_id):
-    query = ds_client.query(kind=constants.user)
-    user_list = list(query.fetch())
-    for user in user_list:
-        for concert_obj in user["concerts"]:
-            if concert_obj["id"] == int(concert_id):
-                user["concerts"].remove(concert_obj)
-                ds_client.put(user)
+    contributions = stats.concert_contributions([concert_id])
+    for user in attendance.attendees(concert_id):
+        if concert_lists.remove_concert_ids(user, [concert_id]):
+            stats.update(user, contributions, -1)
+    attendance.remove_concert(concert_id)
 
 
 def create_band(req):
@@ -135,38 +145,70 @@ def create_band(req):
     if attr_err is not None:
         return attr_err
     # Create band in datastore and send response with result
-    new_band = datastore.entity.Entity(key=ds_client.key(constants.band))
+    new_band = clients.new_entity(key=clients.allocate_key(constants.band))
     update_new_band(new_band, req_body)
-    ds_client.put(new_band)
-    new_band["id"] = new_band.key.id
-    new_band["self"] = req.base_url + "/" + str(new_band.key.id)
-    res = make_response(json.dumps(new_band))
+    change = changes.new_change(constants.band, new_band.key.id, "create", band_change_data(new_band))
+    clients.commit(puts=[new_band, change] + idempotency.committed(new_band.key.id))
+    return finish_create_band(new_band, req)
+
+
+def resume_create_band(band_id, req):
+    # Finish a create whose band was committed by an earlier attempt
+    band = ds_client.get(key=ds_client.key(constants.band, int(band_id)))
+    id_error = validate_band_id(band)
+    if id_error is not None:
+        return id_error
+    return finish_create_band(band, req)
+
+
+def finish_create_band(band, req):
+    search.index_band(band)
+    snapshots.invalidate(constants.band)
+    band["id"] = band.key.id
+    band["self"] = req.base_url + "/" + str(band.key.id)
+    concert_lists.expand_concerts(band, req.host_url)
+    res = make_response(json.dumps(band))
     res.headers.set("Content-type", "application/json")
     res.status_code = 201
     return res
 
 
+def load_band_page(base_url, host_url, q_limit, q_offset):
+    query = ds_client.query(kind=constants.band)
+    eventual = snapshots.is_eventual("bands.list")
+    q_result = query.fetch(limit=q_limit, offset=q_offset, eventual=eventual)
+    bands = list(next(q_result.pages))
+    for band in bands:
+        band["id"] = band.key.id
+        band["self"] = base_url + "/" + str(band.key.id)
+        concert_lists.expand_concerts(band, host_url)
+    return bands, bool(q_result.next_page_token)
+
+
+def count_bands():
+    query = ds_client.query(kind=constants.band)
+    query.keys_only()
+    return len(list(query.fetch(eventual=snapshots.is_eventual("bands.count"))))
+
+
 def get_all_bands(req):
     # Validate request headers
     accept_error = validate_accept_header_json(req.headers)
     if accept_error is not None:
         return accept_error
     # Retrieve and return list of all bands
-    query = ds_client.query(kind=constants.band)
+    base_url = req.base_url
+    host_url = req.host_url
     q_limit = int(req.args.get("limit", str(pg_limit)))
     q_offset = int(req.args.get("offset", "0"))
-    q_result = query.fetch(limit=q_limit, offset=q_offset)
-    band_list = {"bands": list(next(q_result.pages))}
-    for band in band_list["bands"]:
-        band["id"] = band.key.id
-        band["self"] = req.base_url + "/" + str(band.key.id)
-        for concert in band["concerts"]:
-            concert["self"] = req.base_url[:-5] + "concerts/" + str(concert["id"])
+    bands, has_next = snapshots.read(
+        "bands.list", constants.band, (base_url, q_limit, q_offset),
+        lambda: load_band_page(base_url, host_url, q_limit, q_offset))
+    band_list = {"bands": bands}
     band_list["self"] = f"{req.base_url}?limit={q_limit}&offset={q_offset}"
-    if q_result.next_page_token:
+    if has_next:
         band_list["next"] = f"{req.base_url}?limit={q_limit}&offset={q_limit+q_offset}"
-    collection_len = len(list(ds_client.query(kind=constants.band).fetch()))
-    band_list["collection_length"] = collection_len
+    band_list["collection_length"] = snapshots.read("bands.count", constants.band, (), count_bands)
     res = make_response(json.dumps(band_list))
     res.headers.set("Content-type", "application/json")
     res.status_code = 200
@@ -185,8 +227,7 @@ def get_band_with_id(band_id, req):
         return id_error
     band["id"] = band.key.id
     band["self"] = req.base_url
-    for concert in band["concerts"]:
-        concert["self"] = req.base_url[:-22] + "concerts/" + str(concert["id"])
+    concert_lists.expand_concerts(band, req.host_url)
     res = make_response(json.dumps(band))
     res.headers.set("Content-type", "application/json")
     res.status_code = 200
@@ -211,12 +252,16 @@ def edit_band_with_id(band_id, req):
     if key_err is not None:
         return key_err
     # Update band entity and send response with result
+    old_genre = band["genre"]
     update_band_details(band, req_body)
-    ds_client.put(band)
+    change = changes.new_change(constants.band, band.key.id, "update", band_change_data(band))
+    clients.commit(puts=[band, change])
+    stats.change_band_genre(band.key.id, old_genre, band["genre"])
+    search.index_band(band)
+    snapshots.invalidate(constants.band)
     band["id"] = band.key.id
     band["self"] = req.base_url
-    for concert in band["concerts"]:
-        concert["self"] = req.base_url[:-22] + "concerts/" + str(concert["id"])
+    concert_lists.expand_concerts(band, req.host_url)
     res = make_response(json.dumps(band))
     res.headers.set("Content-type", "application/json")
     res.status_code = 200
@@ -234,19 +279,31 @@ def delete_band_with_id(band_id, req):
     if id_error is not None:
         return id_error
     # Remove all band concerts from user concerts and delete concert entities
-    for concert_obj in band["concerts"]:
-        concert_key = ds_client.key(constants.concert, concert_obj["id"])
-        remove_concert_from_all_users(concert_obj["id"])
-        ds_client.delete(concert_key)
+    band_concert_ids = concert_lists.get_concert_ids(band)
+    for concert_id in band_concert_ids:
+        remove_concert_from_all_users(concert_id)
+    batch = constants.changes_batch_size
+    for i in range(0, len(band_concert_ids), batch):
+        concert_ids = band_concert_ids[i:i + batch]
+        clients.commit(
+            puts=[changes.new_change(constants.concert, concert_id, "delete") for concert_id in concert_ids],
+            deletes=[ds_client.key(constants.concert, concert_id) for concert_id in concert_ids]
+        )
+    upcoming.remove_concerts(band_concert_ids)
+    search.remove_documents(constants.concert, band_concert_ids)
     # Delete band entity
-    ds_client.delete(band_key)
+    concert_lists.delete_storage(band)
+    clients.commit(puts=[changes.new_change(constants.band, band_key.id, "delete")], deletes=[band_key])
+    search.remove_documents(constants.band, [band_key.id])
+    snapshots.invalidate(constants.band, constants.concert)
     return ('', 204)
 
 
 @bp.route('', methods=['POST', 'GET'])
 def post_get_bands():
     if request.method == 'POST':
-        return create_band(request)
+        return idempotency.handle(
+            request, lambda: create_band(request), lambda band_id: resume_create_band(band_id, request))
     elif request.method == 'GET':
         return get_all_bands(request)
     else:
@@ -0,0 +1,103 @@
+# Compares the legacy embedded-entity concerts list with the compact storage in
+# concert_lists.py for bands and users with large attendance lists. Sizes are the
+# serialized entity protobufs datastore stores; times are encode + decode of a
+# full read and of a single append. Runs offline (no datastore access needed):
+#     python benchmarks/concert_lists.py --sizes 100 1000 10000 50000
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.cloud import datastore  # noqa: E402
+from google.cloud.datastore import helpers  # noqa: E402
+from google.cloud.datastore_v1.types import entity as entity_pb2  # noqa: E402
+import concert_lists  # noqa: E402
+import constants  # noqa: E402
+
+
+def make_key(kind, *path):
+    return datastore.Key(kind, *path, project="benchmark")
+
+
+def serialize(entity):
+    return helpers.entity_to_protobuf(entity)._pb.SerializeToString()
+
+
+def deserialize(data):
+    return helpers.entity_from_protobuf(entity_pb2.Entity.pb().FromString(data))
+
+
+def read_compact(stored_bytes):
+    ids = []
+    for data in stored_bytes:
+        entity = deserialize(data)
+        ids.extend(concert_lists.unpack_ids(entity.get("ids", entity.get("concert_ids"))))
+    return ids
+
+
+def legacy_band(n):
+    band = datastore.Entity(key=make_key(constants.band, 1))
+    band.update({"name": "Band", "genre": "Rock", "members": ["A", "B"]})
+    band["concerts"] = [{"id": 5000000000000000 + i} for i in range(n)]
+    return band
+
+
+def compact_entities(n):
+    # Returns the owner plus its shards as stored by concert_lists
+    ids = [5000000000000000 + i for i in range(n)]
+    band = datastore.Entity(key=make_key(constants.band, 1))
+    band.update({"name": "Band", "genre": "Rock", "members": ["A", "B"]})
+    concert_lists.init_concert_ids(band)
+    if n <= constants.concert_list_inline_max:
+        band["concert_ids"] = concert_lists.pack_ids(ids)
+        return band, []
+    size = constants.concert_list_shard_size
+    shards = []
+    for i in range(0, n, size):
+        shard = datastore.Entity(key=make_key(constants.band, 1, constants.concert_shard, i // size + 1))
+        shard["ids"] = concert_lists.pack_ids(ids[i:i + size])
+        shards.append(shard)
+    band["concert_shards"] = len(shards)
+    return band, shards
+
+
+def time_ms(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) * 1000
+
+
+def bench(n, repeat):
+    legacy = legacy_band(n)
+    legacy_bytes = serialize(legacy)
+    owner, shards = compact_entities(n)
+    stored = [owner] + shards
+    compact_bytes = [serialize(e) for e in stored]
+    # Appending rewrites the whole legacy entity but only the owner or last shard in compact form
+    append_target = shards[-1] if shards else owner
+    return {
+        "legacy_size": len(legacy_bytes),
+        "compact_size": sum(len(b) for b in compact_bytes),
+        "legacy_read": time_ms(lambda: [c["id"] for c in deserialize(legacy_bytes)["concerts"]], repeat),
+        "compact_read": time_ms(lambda: read_compact(compact_bytes), repeat),
+        "legacy_append": time_ms(lambda: serialize(legacy), repeat),
+        "compact_append": time_ms(lambda: serialize(append_target), repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concert list storage benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(f"{'concerts':>9} {'legacy KiB':>11} {'compact KiB':>12} {'legacy read':>12} "
+          f"{'compact read':>13} {'legacy append':>14} {'compact append':>15}")
+    for n in args.sizes:
+        r = bench(n, args.repeat)
+        print(f"{n:>9} {r['legacy_size'] / 1024:>11.1f} {r['compact_size'] / 1024:>12.1f} "
+              f"{r['legacy_read']:>10.2f}ms {r['compact_read']:>11.2f}ms "
+              f"{r['legacy_append']:>12.2f}ms {r['compact_append']:>13.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
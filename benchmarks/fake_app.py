@@ -0,0 +1,41 @@
+# Serves main:app against the in-memory datastore fake from tests/ with a
+# simulated round trip per RPC, seeded with bands and concerts, so
+# benchmarks/load_test.py can be run without the emulator or a deployment.
+# Each worker gets its own copy of the seeded data. Read snapshots are disabled
+# (every route reads strongly) so each request pays its datastore round trips;
+# set FAKE_SNAPSHOTS=1 to keep the production read_consistency settings. Ids are
+# allocated in order from 5000000000000000, so the first band has that id and
+# its concerts the ids after it. Run from the repository root:
+#     FAKE_DATASTORE_LATENCY=0.02 gunicorn -c gunicorn.conf.py benchmarks.fake_app:app
+import os
+import sys
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+sys.path.insert(0, os.path.join(repo_root, "tests"))
+
+import clients  # noqa: E402
+import constants  # noqa: E402
+import fake_datastore  # noqa: E402
+import main  # noqa: E402
+
+
+def seed(band_count, concerts_per_band):
+    client = main.app.test_client()
+    headers = {"Accept": "application/json", "Content-type": "application/json"}
+    for b in range(band_count):
+        band = client.post("/bands", json={"name": f"Band {b}", "genre": "Rock", "members": ["A", "B"]},
+                           headers=headers).get_json()
+        for c in range(concerts_per_band):
+            client.post("/concerts", json={"venue": f"Venue {c}", "address": f"{c} Main St",
+                                           "date": f"{c % 12 + 1:02d}-15-2031", "band": band["id"]},
+                        headers=headers)
+
+
+if os.environ.get("FAKE_SNAPSHOTS", "0") != "1":
+    constants.read_consistency = {}
+fake = fake_datastore.FakeDatastoreClient()
+clients.ds_client._client = fake
+seed(int(os.environ.get("FAKE_BANDS", "20")), int(os.environ.get("FAKE_CONCERTS_PER_BAND", "10")))
+fake.latency = float(os.environ.get("FAKE_DATASTORE_LATENCY", "0.02"))
+app = main.app
@@ -0,0 +1,85 @@
+# Closed-loop load test used to size gunicorn workers/threads and app.yaml
+# max_concurrent_requests. Each concurrency level runs for --duration seconds
+# against the given paths and reports throughput and latency percentiles.
+#     gunicorn -c gunicorn.conf.py main:app            # or a deployed version
+#     gunicorn -c gunicorn.conf.py benchmarks.fake_app:app   # no emulator needed
+#     python benchmarks/load_test.py --url http://localhost:8080 \
+#         --path /bands --path /concerts --path /bands/5000000000000000 \
+#         --path /concerts/5000000000000001 --concurrency 8 16 32 64
+import argparse
+import statistics
+import threading
+import time
+import requests
+
+
+def worker(base_url, paths, deadline, results, lock):
+    session = requests.Session()
+    latencies = []
+    errors = 0
+    i = 0
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            res = session.get(base_url + path, headers={"Accept": "application/json"}, timeout=30)
+            if res.status_code >= 500:
+                errors += 1
+        except requests.RequestException:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    with lock:
+        results["latencies"].extend(latencies)
+        results["errors"] += errors
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def run_level(base_url, paths, concurrency, duration):
+    results = {"latencies": [], "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=worker, args=(base_url, paths, deadline, results, lock))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = sorted(results["latencies"])
+    if not latencies:
+        return None
+    return {
+        "rps": len(latencies) / duration,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "errors": results["errors"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Closed-loop HTTP load test")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--path", action="append", default=None)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 16, 32, 64])
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+    paths = args.path or ["/bands", "/concerts"]
+    print(f"{'clients':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for concurrency in args.concurrency:
+        r = run_level(args.url.rstrip("/"), paths, concurrency, args.duration)
+        if r is None:
+            print(f"{concurrency:>8} no completed requests")
+            continue
+        print(f"{concurrency:>8} {r['rps']:>9.1f} {r['p50']:>9.1f} {r['p95']:>9.1f} "
+              f"{r['p99']:>9.1f} {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Simulates a login spike against datastore (use the emulator:
+# DATASTORE_EMULATOR_HOST=localhost:8081). Each simulated login stores a fresh
+# state, then runs the same validate_state + complete_login path as main.home,
+# minus the Google token exchange. A share of logins are returning users and a
+# share of those have changed names, which exercises the write-behind buffer
+# when --write-behind is given. Run from the repository root:
+#     python benchmarks/login_burst.py --logins 2000 --concurrency 32 --write-behind
+import argparse
+import collections
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import constants  # noqa: E402
+import main  # noqa: E402
+import write_behind  # noqa: E402
+
+
+def make_user_info(user_pool, returning_share, rename_share):
+    if user_pool and random.random() < returning_share:
+        user_id = random.choice(user_pool)
+    else:
+        user_id = f"bench-{random.getrandbits(48)}"
+        user_pool.append(user_id)
+    suffix = str(random.getrandbits(16)) if random.random() < rename_share else ""
+    return {"f_name": "Bench" + suffix, "l_name": "User", "user_id": user_id}
+
+
+def login(user_info):
+    # Returns (outcome, seconds); errors are counted rather than ending the run
+    start = time.perf_counter()
+    try:
+        state = main.generate_new_state()
+        outcome = "ok" if main.validate_state(state) and main.complete_login(state, user_info) else "rejected"
+    except Exception as e:
+        outcome = type(e).__name__
+    return outcome, time.perf_counter() - start
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Login burst benchmark")
+    parser.add_argument("--logins", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--returning-share", type=float, default=0.7)
+    parser.add_argument("--rename-share", type=float, default=0.2)
+    parser.add_argument("--write-behind", action="store_true")
+    args = parser.parse_args()
+    constants.login_write_behind = args.write_behind
+    user_pool = []
+    infos = [make_user_info(user_pool, args.returning_share, args.rename_share) for _ in range(args.logins)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(login, infos))
+    elapsed = time.perf_counter() - start
+    flush_start = time.perf_counter()
+    flushed = write_behind.flush() or 0
+    flush_elapsed = time.perf_counter() - flush_start
+    latencies = sorted(r[1] * 1000 for r in results)
+    outcomes = collections.Counter(r[0] for r in results)
+    failures = args.logins - outcomes["ok"]
+    print(f"logins: {args.logins}  concurrency: {args.concurrency}  write-behind: {args.write_behind}")
+    print(f"throughput: {args.logins / elapsed:.1f} logins/s  failures: {failures}")
+    for outcome, count in sorted(outcomes.items()):
+        if outcome != "ok":
+            print(f"  {outcome}: {count}")
+    print(f"latency ms: p50 {statistics.median(latencies):.1f}  "
+          f"p95 {latencies[max(0, int(len(latencies) * 0.95) - 1)]:.1f}  max {latencies[-1]:.1f}")
+    print(f"final write-behind flush: {flushed} users in {flush_elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,58 @@
+# Measures cold-start cost: time to import the app and latency of the first
+# requests served by a fresh process. Run from the repository root:
+#     python benchmarks/startup.py --runs 10 --path / --path /bands
+# Paths that touch datastore need credentials or DATASTORE_EMULATOR_HOST set.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+child_script = """
+import json, sys, time
+start = time.perf_counter()
+import main
+import_time = time.perf_counter() - start
+client = main.app.test_client()
+first_requests = []
+for path in sys.argv[1:]:
+    start = time.perf_counter()
+    res = client.get(path, headers={"Accept": "application/json"})
+    first_requests.append([path, res.status_code, time.perf_counter() - start])
+print(json.dumps({"import": import_time, "requests": first_requests}))
+"""
+
+
+def run_once(paths):
+    output = subprocess.run(
+        [sys.executable, "-c", child_script] + paths,
+        cwd=repo_root, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(label, samples):
+    samples_ms = [s * 1000 for s in samples]
+    print(f"{label:<30} median {statistics.median(samples_ms):8.1f} ms"
+          f"   min {min(samples_ms):8.1f} ms   max {max(samples_ms):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup-time benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--path", action="append", default=None)
+    args = parser.parse_args()
+    paths = args.path or ["/"]
+    results = [run_once(paths) for _ in range(args.runs)]
+    summarize("import main", [r["import"] for r in results])
+    for i, path in enumerate(paths):
+        statuses = set(r["requests"][i][1] for r in results)
+        summarize(f"first GET {path} {sorted(statuses)}", [r["requests"][i][2] for r in results])
+
+
+if __name__ == "__main__":
+    main()
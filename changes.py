@@ -0,0 +1,197 @@
+from flask import Blueprint, request, make_response, Response, stream_with_context
+import datetime
+import json
+import random
+import threading
+import time
+import clients
+import constants
+import users
+
+
+ds_client = clients.ds_client
+bp = Blueprint('changes', __name__, url_prefix='/changes')
+latest_seq_cache = {"seq": 0, "checked_at": 0.0}
+latest_seq_lock = threading.Lock()
+# Each open stream holds a server thread, so streams per process are capped to
+# leave threads free for ordinary requests
+stream_slots = threading.BoundedSemaphore(constants.changes_max_streams)
+
+
+def invalid_method_response(allowed_methods):
+    res = make_response()
+    res.headers.set("Allow", allowed_methods)
+    res.status_code = 405
+    return res
+
+
+def seq_at(timestamp):
+    # Sequence numbers are microseconds since the epoch with a random suffix, so
+    # they order by time without any shared counter
+    return int(timestamp * 1000000) * 1000
+
+
+def new_change(kind, entity_id, op, data=None, owner=None):
+    # Build a change entry to commit (with clients.commit) in the same transaction
+    # as the write it describes; its sequence number is assigned by assign_seqs
+    change = clients.new_entity(key=ds_client.key(constants.change), exclude_from_indexes=("data",))
+    change.update({
+        "kind": kind,
+        "id": str(entity_id),
+        "op": op,
+        "data": json.dumps(data),
+        "owner": owner
+    })
+    return change
+
+
+def assign_seqs(change_list):
+    # Runs inside each commit attempt, so a retried commit draws fresh numbers.
+    # Numbers already taken (by a committed entry or another entry in this
+    # commit) are re-drawn; concurrent commits drawing the same number conflict
+    # on the key and retry
+    drawn = set()
+    pending = list(change_list)
+    while pending:
+        now = time.time()
+        for change in pending:
+            seq = seq_at(now) + random.randrange(1000)
+            while seq in drawn:
+                seq = seq_at(now) + random.randrange(1000)
+            drawn.add(seq)
+            change.key = ds_client.key(constants.change, seq)
+            change["seq"] = seq
+            change["timestamp"] = datetime.datetime.fromtimestamp(now, datetime.timezone.utc)
+        taken = set(entity.key.id for entity in ds_client.get_multi([change.key for change in pending]))
+        pending = [change for change in pending if change["seq"] in taken]
+
+
+clients.commit_key_assigners[constants.change] = assign_seqs
+
+
+def latest_seq():
+    # Shared across requests so idle pollers cost at most one keys-only query per interval
+    with latest_seq_lock:
+        if time.monotonic() - latest_seq_cache["checked_at"] >= constants.changes_poll_seconds:
+            query = ds_client.query(kind=constants.change)
+            query.keys_only()
+            query.order = ["-seq"]
+            newest = list(query.fetch(limit=1))
+            latest_seq_cache["seq"] = newest[0].key.id if newest else 0
+            latest_seq_cache["checked_at"] = time.monotonic()
+        return latest_seq_cache["seq"]
+
+
+def fetch_changes(since, limit, viewer_id):
+    # Return visible changes after since and the last sequence number scanned
+    if latest_seq() <= since:
+        return [], since
+    query = ds_client.query(kind=constants.change)
+    query.add_filter("seq", ">", since)
+    # Hold back entries inside the settle window
+    query.add_filter("seq", "<=", seq_at(time.time() - constants.changes_settle_seconds))
+    query.order = ["seq"]
+    change_list = []
+    for change in query.fetch(limit=limit):
+        since = change["seq"]
+        # User attendance changes are only visible to that user
+        if change["owner"] is not None and change["owner"] != viewer_id:
+            continue
+        change_list.append({
+            "seq": change["seq"],
+            "kind": change["kind"],
+            "id": change["id"],
+            "op": change["op"],
+            "data": json.loads(change["data"]),
+            "timestamp": change["timestamp"].isoformat()
+        })
+    return change_list, since
+
+
+def parse_since(req):
+    since = req.args.get("since", req.headers.get("Last-Event-ID", "0"))
+    try:
+        return max(int(since), 0)
+    except ValueError:
+        return None
+
+
+def since_error_response():
+    res = make_response(json.dumps({"Error": "since must be a non-negative integer"}))
+    res.headers.set("Content-type", "application/json")
+    res.status_code = 400
+    return res
+
+
+def get_changes(req):
+    # Validate request headers and since parameter
+    accept_err = users.validate_accept_header_json(req.headers)
+    if accept_err is not None:
+        return accept_err
+    since = parse_since(req)
+    if since is None:
+        return since_error_response()
+    # Retrieve and return changes after since
+    q_limit = min(int(req.args.get("limit", str(constants.changes_pg_limit))), constants.changes_pg_limit)
+    change_list, last_seq = fetch_changes(since, q_limit, users.get_id_from_jwt(req))
+    body = {
+        "changes": change_list,
+        "last_seq": last_seq,
+        "next": f"{req.base_url}?since={last_seq}&limit={q_limit}"
+    }
+    res = make_response(json.dumps(body))
+    res.headers.set("Content-type", "application/json")
+    res.status_code = 200
+    return res
+
+
+def change_events(since, viewer_id):
+    # Poll the change log until the stream deadline; clients resume with Last-Event-ID
+    deadline = time.monotonic() + constants.changes_stream_seconds
+    yield f"retry: {constants.changes_poll_seconds * 1000}\n\n"
+    while time.monotonic() < deadline:
+        change_list, last_seq = fetch_changes(since, constants.changes_pg_limit, viewer_id)
+        for change in change_list:
+            yield f"id: {change['seq']}\nevent: change\ndata: {json.dumps(change)}\n\n"
+        if last_seq == since:
+            yield ": keepalive\n\n"
+            time.sleep(constants.changes_poll_seconds)
+        since = last_seq
+
+
+def stream_changes(req):
+    since = parse_since(req)
+    if since is None:
+        return since_error_response()
+    viewer_id = users.get_id_from_jwt(req)
+    if not stream_slots.acquire(blocking=False):
+        res = make_response(json.dumps({"Error": "Too many open change streams; poll /changes instead"}))
+        res.headers.set("Content-type", "application/json")
+        res.headers.set("Retry-After", str(constants.changes_stream_seconds))
+        res.status_code = 503
+        return res
+    res = Response(stream_with_context(change_events(since, viewer_id)))
+    res.call_on_close(stream_slots.release)
+    res.headers.set("Content-type", "text/event-stream")
+    res.headers.set("Cache-Control", "no-cache")
+    res.headers.set("X-Accel-Buffering", "no")
+    res.status_code = 200
+    return res
+
+
+@bp.route('', methods=['GET'])
+def get_change_feed():
+    if request.method == 'GET':
+        return get_changes(request)
+    else:
+        allowed_methods = 'GET'
+        return invalid_method_response(allowed_methods)
+
+
+@bp.route('/stream', methods=['GET'])
+def get_change_stream():
+    if request.method == 'GET':
+        return stream_changes(request)
+    else:
+        allowed_methods = 'GET'
+        return invalid_method_response(allowed_methods)
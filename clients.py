@@ -0,0 +1,120 @@
+import functools
+import json
+import random
+import threading
+import time
+import constants
+
+
+client_secrets_file = 'client_secret.json'
+oauth_scopes = ['https://www.googleapis.com/auth/userinfo.profile']
+
+
+class LazyDatastoreClient:
+    # Defers importing google.cloud.datastore and building the client until first use
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _ensure_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google.cloud import datastore
+                    self._client = datastore.Client()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self._ensure_client(), name)
+
+
+ds_client = LazyDatastoreClient()
+# Functions called inside each commit attempt with that attempt's entities of
+# their kind, for keys that must be assigned at commit time (see changes.py)
+commit_key_assigners = {}
+
+
+def run_in_transaction(fn):
+    # Run fn inside a transaction, retrying a bounded number of times on contention
+    from google.api_core import exceptions
+    for attempt in range(constants.transaction_attempts):
+        try:
+            with ds_client.transaction():
+                return fn()
+        except (exceptions.Conflict, exceptions.Aborted):
+            if attempt == constants.transaction_attempts - 1:
+                raise
+            time.sleep(random.uniform(0, constants.transaction_backoff_seconds * 2 ** attempt))
+
+
+def commit(puts=(), deletes=()):
+    # Apply all writes atomically (at most 500 mutations per call)
+    def write():
+        if deletes:
+            ds_client.delete_multi(list(deletes))
+        if puts:
+            for kind, assign_keys in commit_key_assigners.items():
+                entities = [entity for entity in puts if entity.key.kind == kind]
+                if entities:
+                    assign_keys(entities)
+            ds_client.put_multi(list(puts))
+    run_in_transaction(write)
+
+
+def chunks(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def get_multi(keys):
+    # Lookups split into batches within the per-call key limit
+    found = []
+    for batch in chunks(keys, constants.lookup_batch_size):
+        found.extend(ds_client.get_multi(batch))
+    return found
+
+
+def put_multi(entities):
+    for batch in chunks(entities, constants.mutation_batch_size):
+        ds_client.put_multi(batch)
+
+
+def delete_multi(keys):
+    for batch in chunks(keys, constants.mutation_batch_size):
+        ds_client.delete_multi(batch)
+
+
+def allocate_key(kind):
+    return ds_client.allocate_ids(ds_client.key(kind), 1)[0]
+
+
+def new_entity(key, exclude_from_indexes=()):
+    from google.cloud.datastore import Entity
+    return Entity(key=key, exclude_from_indexes=exclude_from_indexes)
+
+
+@functools.lru_cache(maxsize=None)
+def get_client_config():
+    with open(client_secrets_file, 'r') as client_secret_json:
+        return json.load(client_secret_json)
+
+
+def get_client_id():
+    return get_client_config()['web']['client_id']
+
+
+def new_oauth_flow(state=None):
+    # Flow objects hold per-login state, so only the parsed client config is shared
+    import google_auth_oauthlib.flow
+    return google_auth_oauthlib.flow.Flow.from_client_config(
+        get_client_config(),
+        scopes=oauth_scopes,
+        state=state
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_auth_request():
+    from google.auth.transport import requests as grequests
+    return grequests.Request()
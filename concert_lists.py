@@ -0,0 +1,180 @@
+import array
+import clients
+import constants
+
+
+# Band and user entities store their concert ids as a packed array of 64-bit
+# integers in "concert_ids". Lists longer than concert_list_inline_max move to
+# concert_shard child entities of concert_list_shard_size ids each, so an
+# append rewrites one shard instead of the whole list. Entities still using the
+# legacy "concerts" list of {"id": int} embedded entities are read as-is and
+# converted on their next write.
+ds_client = clients.ds_client
+storage_properties = ("concert_ids", "concert_shards", "concerts")
+
+
+def pack_ids(concert_ids):
+    return array.array("q", concert_ids).tobytes()
+
+
+def unpack_ids(packed):
+    ids = array.array("q")
+    if packed:
+        ids.frombytes(packed)
+    return ids.tolist()
+
+
+def shard_key(owner, shard_num):
+    return ds_client.key(constants.concert_shard, shard_num, parent=owner.key)
+
+
+def new_shard(owner, shard_num, concert_ids):
+    shard = clients.new_entity(key=shard_key(owner, shard_num), exclude_from_indexes=("ids",))
+    shard["ids"] = pack_ids(concert_ids)
+    return shard
+
+
+def load_shards(owner):
+    keys = [shard_key(owner, i) for i in range(1, owner.get("concert_shards", 0) + 1)]
+    shards = clients.get_multi(keys)
+    shards.sort(key=lambda shard: shard.key.id)
+    return shards
+
+
+def init_concert_ids(owner):
+    owner.exclude_from_indexes.add("concert_ids")
+    owner["concert_ids"] = pack_ids([])
+    owner["concert_shards"] = 0
+    owner.pop("concerts", None)
+
+
+def get_concert_ids(owner):
+    if owner.get("concert_shards", 0) > 0:
+        return [cid for shard in load_shards(owner) for cid in unpack_ids(shard["ids"])]
+    if "concert_ids" in owner:
+        return unpack_ids(owner["concert_ids"])
+    return [concert["id"] for concert in owner.get("concerts", [])]
+
+
+def write_inline(owner, concert_ids, extra=()):
+    if len(concert_ids) > constants.concert_list_inline_max:
+        return write_sharded(owner, concert_ids, extra)
+    init_concert_ids(owner)
+    owner["concert_ids"] = pack_ids(concert_ids)
+    clients.commit(puts=[owner] + list(extra))
+
+
+def write_sharded(owner, concert_ids, extra=()):
+    # Rewrite the whole list as shards (used when a list first outgrows inline storage)
+    size = constants.concert_list_shard_size
+    shards = [
+        new_shard(owner, i // size + 1, concert_ids[i:i + size])
+        for i in range(0, len(concert_ids), size)
+    ]
+    old_count = owner.get("concert_shards", 0)
+    init_concert_ids(owner)
+    owner["concert_shards"] = len(shards)
+    stale_keys = [shard_key(owner, i) for i in range(len(shards) + 1, old_count + 1)]
+    clients.commit(puts=shards + [owner] + list(extra), deletes=stale_keys)
+
+
+def extra_for(extra_entities, changed_ids):
+    if extra_entities is None or not changed_ids:
+        return []
+    return extra_entities(changed_ids)
+
+
+def add_concert_ids(owner, concert_ids, extra_entities=None):
+    # Append ids not already present and persist; returns the ids added.
+    # extra_entities(added) may return entities to commit in the same transaction
+    if owner.get("concert_shards", 0) == 0:
+        current = get_concert_ids(owner)
+        existing = set(current)
+        added = [cid for cid in dict.fromkeys(int(c) for c in concert_ids) if cid not in existing]
+        if added or "concert_ids" not in owner:
+            write_inline(owner, current + added, extra_for(extra_entities, added))
+        return added
+    shards = load_shards(owner)
+    existing = set(cid for shard in shards for cid in unpack_ids(shard["ids"]))
+    added = [cid for cid in dict.fromkeys(int(c) for c in concert_ids) if cid not in existing]
+    if not added:
+        return added
+    last_ids = unpack_ids(shards[-1]["ids"])
+    room = constants.concert_list_shard_size - len(last_ids)
+    changed = [new_shard(owner, shards[-1].key.id, last_ids + added[:room])]
+    remaining = added[room:]
+    size = constants.concert_list_shard_size
+    for i in range(0, len(remaining), size):
+        changed.append(new_shard(owner, len(shards) + i // size + 1, remaining[i:i + size]))
+    if len(changed) > 1:
+        owner["concert_shards"] = len(shards) + len(changed) - 1
+        changed.append(owner)
+    clients.commit(puts=changed + extra_for(extra_entities, added))
+    return added
+
+
+def remove_concert_ids(owner, concert_ids, extra_entities=None):
+    # Remove ids if present and persist; returns the ids removed.
+    # extra_entities(removed) may return entities to commit in the same transaction
+    remove_set = set(int(c) for c in concert_ids)
+    if owner.get("concert_shards", 0) == 0:
+        current = get_concert_ids(owner)
+        removed = [cid for cid in current if cid in remove_set]
+        if removed:
+            write_inline(owner, [cid for cid in current if cid not in remove_set],
+                         extra_for(extra_entities, removed))
+        return removed
+    removed = []
+    changed = []
+    for shard in load_shards(owner):
+        shard_ids = unpack_ids(shard["ids"])
+        kept = [cid for cid in shard_ids if cid not in remove_set]
+        if len(kept) != len(shard_ids):
+            removed.extend(cid for cid in shard_ids if cid in remove_set)
+            shard["ids"] = pack_ids(kept)
+            changed.append(shard)
+    if changed:
+        clients.commit(puts=changed + extra_for(extra_entities, removed))
+    return removed
+
+
+def expand_concerts(owner, host_url, concert_ids=None):
+    # Replace the storage properties with the response form of the concerts list
+    if concert_ids is None:
+        concert_ids = get_concert_ids(owner)
+    for prop in storage_properties:
+        owner.pop(prop, None)
+    owner["concerts"] = [
+        {"id": cid, "self": host_url + "concerts/" + str(cid)} for cid in concert_ids
+    ]
+
+
+def is_legacy(owner):
+    return "concert_ids" not in owner and owner.get("concert_shards", 0) == 0
+
+
+def migrate_entities(owners):
+    # Convert legacy embedded-entity lists to compact storage; returns the number converted
+    inline = []
+    converted = 0
+    for owner in owners:
+        if not is_legacy(owner):
+            continue
+        concert_ids = get_concert_ids(owner)
+        if len(concert_ids) > constants.concert_list_inline_max:
+            write_sharded(owner, concert_ids)
+        else:
+            init_concert_ids(owner)
+            owner["concert_ids"] = pack_ids(concert_ids)
+            inline.append(owner)
+        converted += 1
+    if inline:
+        clients.put_multi(inline)
+    return converted
+
+
+def delete_storage(owner):
+    # Delete any shard entities (call when the owner entity is deleted)
+    shard_count = owner.get("concert_shards", 0)
+    if shard_count > 0:
+        clients.delete_multi([shard_key(owner, i) for i in range(1, shard_count + 1)])
@@ -1,10 +1,20 @@
 from flask import Blueprint, request, make_response
-from google.cloud import datastore
+import datetime
 import json
+import urllib.parse
+import attendance
+import changes
+import clients
+import concert_lists
 import constants
+import idempotency
+import search
+import snapshots
+import stats
+import upcoming
 
 
-ds_client = datastore.Client()
+ds_client = clients.ds_client
 bp = Blueprint('concerts', __name__, url_prefix='/concerts')
 pg_limit = 5
 
@@ -64,31 +74,53 @@ def validate_band_id(band):
     return None
 
 
-def validate_date_format(date):
-    err = {"Error": "Date must be in format MM-DD-YYYY and a real date that exists"}
-    month_days = {
-        1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30,
-        7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31
-    }
-    date_err = False
+def parse_concert_date(date):
+    # Accept MM-DD-YYYY or ISO-8601 (a date or a timestamp); returns a datetime in the
+    # given offset (UTC if none), or None if it is invalid or has no UTC equivalent
     if type(date) != str:
-        date_err = True
-    date_list = date.split("-")
-    if len(date_list) != 3:
-        date_err = True
-    else:
-        month = int(date_list[0])
-        day = int(date_list[1])
-        year = int(date_list[2])
-        if year % 4 == 0:
-            month_days[2] += 1
-        if year < 0 or year > 9999:
-            date_err = True
-        if month < 1 or month > 12:
-            date_err = True
-        if day < 1 or day > month_days[month]:
-            date_err = True
-    if date_err:
+        return None
+    try:
+        return datetime.datetime.strptime(date, "%m-%d-%Y").replace(tzinfo=datetime.timezone.utc)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.datetime.fromisoformat(date.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=datetime.timezone.utc)
+    try:
+        parsed.astimezone(datetime.timezone.utc)
+    except OverflowError:
+        return None
+    return parsed
+
+
+def legacy_date(parsed):
+    return f"{parsed.month:02d}-{parsed.day:02d}-{parsed.year:04d}"
+
+
+def date_updates(date):
+    # The legacy date keeps the calendar date as given; the timestamp is the UTC instant
+    parsed = parse_concert_date(date)
+    return {"date": legacy_date(parsed), "timestamp": parsed.astimezone(datetime.timezone.utc)}
+
+
+def range_end(date):
+    # Exclusive upper bound for a to= filter: the end of the day for a bare date
+    # (MM-DD-YYYY or YYYY-MM-DD), just past the instant for a timestamp
+    end = parse_concert_date(date).astimezone(datetime.timezone.utc)
+    try:
+        if len(date) == 10:
+            return end + datetime.timedelta(days=1)
+        return end + datetime.timedelta(microseconds=1)
+    except OverflowError:
+        return None
+
+
+def validate_date_format(date):
+    err = {"Error": "Date must be in format MM-DD-YYYY or ISO-8601 and a real date that exists"}
+    if parse_concert_date(date) is None:
         res = make_response(json.dumps(err))
         res.headers.set("Content-type", "application/json")
         res.status_code = 400
@@ -96,6 +128,11 @@ def validate_date_format(date):
     return None
 
 
+def serialize_timestamp(concert):
+    if isinstance(concert.get("timestamp"), datetime.datetime):
+        concert["timestamp"] = concert["timestamp"].isoformat()
+
+
 def validate_concert_attribute_keys(req_body):
     allowed = ["venue", "address", "date", "band"]
     err = {"Error": "The request object includes additional attributes which are not permitted"}
@@ -138,33 +175,43 @@ def validate_concert_attributes(req_body):
 
 def add_concert_to_band(concert_id, band_id):
     band = ds_client.get(key=ds_client.key(constants.band, int(band_id)))
-    band["concerts"].append({"id": int(concert_id)})
-    ds_client.put(band)
+    concert_lists.add_concert_ids(band, [concert_id])
 
 
 def remove_concert_from_band(concert_id, band_id):
     band = ds_client.get(key=ds_client.key(constants.band, int(band_id)))
-    for concert in band["concerts"]:
-        if concert["id"] == int(concert_id):
-            band["concerts"].remove(concert)
-    ds_client.put(band)
+    concert_lists.remove_concert_ids(band, [concert_id])
 
 
 def remove_concert_from_all_users(concert_id):
-    query = ds_client.query(kind=constants.user)
-    user_list = list(query.fetch())
-    for user in user_list:
-        for concert_obj in user["concerts"]:
-            if concert_obj["id"] == int(concert_id):
-                user["concerts"].remove(concert_obj)
-                ds_client.put(user)
+    contributions = stats.concert_contributions([concert_id])
+    for user in attendance.attendees(concert_id):
+        if concert_lists.remove_concert_ids(user, [concert_id]):
+            stats.update(user, contributions, -1)
+    attendance.remove_concert(concert_id)
+
+
+def update_concert_for_all_users(concert_id, old_contribution, new_contribution):
+    if old_contribution == new_contribution:
+        return
+    for user in attendance.attendees(concert_id):
+        stats.replace_contribution(user, old_contribution, new_contribution)
+
+
+def concert_change_data(concert):
+    return {
+        "venue": concert["venue"],
+        "address": concert["address"],
+        "date": concert["date"],
+        "band": concert["band"]["id"]
+    }
 
 
 def update_new_concert(concert, req_body):
     updates = {}
     updates["venue"] = req_body["venue"]
     updates["address"] = req_body["address"]
-    updates["date"] = req_body["date"]
+    updates.update(date_updates(req_body["date"]))
     updates["band"] = {"id": req_body["band"]}
     concert.update(updates)
 
@@ -176,7 +223,7 @@ def update_concert_details(concert, req_body):
     if "address" in req_body:
         updates["address"] = req_body["address"]
     if "date" in req_body:
-        updates["date"] = req_body["date"]
+        updates.update(date_updates(req_body["date"]))
     if "band" in req_body and req_body["band"] != concert["band"]["id"]:
         updates["band"] = {"id": req_body["band"]}
         add_concert_to_band(concert.key.id, req_body["band"])
@@ -198,39 +245,105 @@ def create_concert(req):
     if attr_err is not None:
         return attr_err
     # Create concert in datastore and send response with result
-    new_concert = datastore.entity.Entity(key=ds_client.key(constants.concert))
+    new_concert = clients.new_entity(key=clients.allocate_key(constants.concert))
     update_new_concert(new_concert, req_body)
-    ds_client.put(new_concert)
-    add_concert_to_band(new_concert.key.id, new_concert["band"]["id"])
-    new_concert["id"] = new_concert.key.id
-    new_concert["self"] = req.base_url + "/" + str(new_concert.key.id)
-    new_concert["band"]["self"] = req.base_url[:-8] + "bands/" + str(new_concert["band"]["id"])
-    res = make_response(json.dumps(new_concert))
+    change = changes.new_change(constants.concert, new_concert.key.id, "create", concert_change_data(new_concert))
+    clients.commit(puts=[new_concert, change] + idempotency.committed(new_concert.key.id))
+    return finish_create_concert(new_concert, req)
+
+
+def resume_create_concert(concert_id, req):
+    # Finish a create whose concert was committed by an earlier attempt
+    concert = ds_client.get(key=ds_client.key(constants.concert, int(concert_id)))
+    id_error = validate_concert_id(concert)
+    if id_error is not None:
+        return id_error
+    return finish_create_concert(concert, req)
+
+
+def finish_create_concert(concert, req):
+    # Side effects are idempotent so a resumed create can safely repeat them
+    add_concert_to_band(concert.key.id, concert["band"]["id"])
+    upcoming.upsert_concert(concert)
+    snapshots.invalidate(constants.concert, constants.band)
+    search.index_concert(concert)
+    concert["id"] = concert.key.id
+    concert["self"] = req.base_url + "/" + str(concert.key.id)
+    concert["band"]["self"] = req.base_url[:-8] + "bands/" + str(concert["band"]["id"])
+    serialize_timestamp(concert)
+    res = make_response(json.dumps(concert))
     res.headers.set("Content-type", "application/json")
     res.status_code = 201
     return res
 
 
+def concert_query(date_from=None, date_before=None, sort_by_date=False):
+    # Date ranges and sorting use the indexed timestamp property; date_before is exclusive
+    query = ds_client.query(kind=constants.concert)
+    if date_from is not None:
+        query.add_filter("timestamp", ">=", date_from)
+    if date_before is not None:
+        query.add_filter("timestamp", "<", date_before)
+    if date_from is not None or date_before is not None or sort_by_date:
+        query.order = ["timestamp"]
+    return query
+
+
+def load_concert_page(base_url, q_limit, q_offset, date_args):
+    query = concert_query(*date_args)
+    eventual = snapshots.is_eventual("concerts.list")
+    q_result = query.fetch(limit=q_limit, offset=q_offset, eventual=eventual)
+    concerts = list(next(q_result.pages))
+    for concert in concerts:
+        concert["id"] = concert.key.id
+        concert["self"] = base_url + "/" + str(concert.key.id)
+        concert["band"]["self"] = base_url[:-8] + "bands/" + str(concert["band"]["id"])
+        serialize_timestamp(concert)
+    return concerts, bool(q_result.next_page_token)
+
+
+def count_concerts(date_args):
+    query = concert_query(*date_args)
+    query.keys_only()
+    return len(list(query.fetch(eventual=snapshots.is_eventual("concerts.count"))))
+
+
 def get_all_concerts(req):
     # Validate request headers
     accept_error = validate_accept_header_json(req.headers)
     if accept_error is not None:
         return accept_error
+    # Validate optional date range (from/to) and sort parameters
+    date_args = []
+    for arg in ("from", "to"):
+        if arg in req.args:
+            date_err = validate_date_format(req.args[arg])
+            if date_err is not None:
+                return date_err
+            if arg == "from":
+                date_args.append(parse_concert_date(req.args[arg]).astimezone(datetime.timezone.utc))
+            else:
+                date_args.append(range_end(req.args[arg]))
+        else:
+            date_args.append(None)
+    date_args.append(req.args.get("sort") == "date")
+    date_args = tuple(date_args)
+    filter_args = urllib.parse.urlencode([(arg, req.args[arg]) for arg in ("from", "to", "sort") if arg in req.args])
+    if filter_args:
+        filter_args = "&" + filter_args
     # Retrieve and return list of all concerts
-    query = ds_client.query(kind=constants.concert)
+    base_url = req.base_url
     q_limit = int(req.args.get("limit", str(pg_limit)))
     q_offset = int(req.args.get("offset", "0"))
-    q_result = query.fetch(limit=q_limit, offset=q_offset)
-    concert_list = {"concerts": list(next(q_result.pages))}
-    for concert in concert_list["concerts"]:
-        concert["id"] = concert.key.id
-        concert["self"] = req.base_url + "/" + str(concert.key.id)
-        concert["band"]["self"] = req.base_url[:-8] + "bands/" + str(concert["band"]["id"])
-    concert_list["self"] = f"{req.base_url}?limit={q_limit}&offset={q_offset}"
-    if q_result.next_page_token:
-        concert_list["next"] = f"{req.base_url}?limit={q_limit}&offset={q_limit+q_offset}"
-    collection_len = len(list(ds_client.query(kind=constants.concert).fetch()))
-    concert_list["collection_length"] = collection_len
+    concerts, has_next = snapshots.read(
+        "concerts.list", constants.concert, (base_url, q_limit, q_offset) + date_args,
+        lambda: load_concert_page(base_url, q_limit, q_offset, date_args))
+    concert_list = {"concerts": concerts}
+    concert_list["self"] = f"{req.base_url}?limit={q_limit}&offset={q_offset}{filter_args}"
+    if has_next:
+        concert_list["next"] = f"{req.base_url}?limit={q_limit}&offset={q_limit+q_offset}{filter_args}"
+    concert_list["collection_length"] = snapshots.read(
+        "concerts.count", constants.concert, date_args, lambda: count_concerts(date_args))
     res = make_response(json.dumps(concert_list))
     res.headers.set("Content-type", "application/json")
     res.status_code = 200
@@ -250,6 +363,7 @@ def get_concert_with_id(concert_id, req):
     concert["id"] = concert.key.id
     concert["self"] = req.base_url
     concert["band"]["self"] = req.base_url[:-25] + "bands/" + str(concert["band"]["id"])
+    serialize_timestamp(concert)
     res = make_response(json.dumps(concert))
     res.headers.set("Content-type", "application/json")
     res.status_code = 200
@@ -283,11 +397,23 @@ def edit_concert_with_id(concert_id, req):
         if band_err is not None:
             return band_err
     # Update concert entity and send response with result
+    stats_changed = "band" in req_body or "date" in req_body
+    if stats_changed:
+        old_contribution = stats.concert_contributions([concert.key.id])[0]
     update_concert_details(concert, req_body)
-    ds_client.put(concert)
+    change = changes.new_change(constants.concert, concert.key.id, "update", concert_change_data(concert))
+    clients.commit(puts=[concert, change])
+    if stats_changed:
+        new_contribution = stats.concert_contributions([concert.key.id])[0]
+        update_concert_for_all_users(concert.key.id, old_contribution, new_contribution)
+    attendance.update_concert(concert)
+    upcoming.upsert_concert(concert)
+    snapshots.invalidate(constants.concert, constants.band)
+    search.index_concert(concert)
     concert["id"] = concert.key.id
     concert["self"] = req.base_url
     concert["band"]["self"] = req.base_url[:-25] + "bands/" + str(concert["band"]["id"])
+    serialize_timestamp(concert)
     res = make_response(json.dumps(concert))
     res.headers.set("Content-type", "application/json")
     res.status_code = 200
@@ -308,14 +434,51 @@ def delete_concert_with_id(concert_id, req):
     remove_concert_from_all_users(concert_id)
     remove_concert_from_band(concert.key.id, concert["band"]["id"])
     # Delete concert entity
-    ds_client.delete(concert_key)
+    clients.commit(puts=[changes.new_change(constants.concert, concert_key.id, "delete")], deletes=[concert_key])
+    upcoming.remove_concerts([concert_id])
+    snapshots.invalidate(constants.concert, constants.band)
+    search.remove_documents(constants.concert, [concert_key.id])
+    return ('', 204)
+
+
+def get_upcoming(req):
+    # Validate request headers
+    accept_error = validate_accept_header_json(req.headers)
+    if accept_error is not None:
+        return accept_error
+    # Retrieve and return one page of upcoming concerts, optionally for one band
+    q_limit = int(req.args.get("limit", str(pg_limit)))
+    q_cursor = req.args.get("cursor")
+    q_band = req.args.get("band")
+    entries, next_cursor = upcoming.fetch_page(q_limit, q_cursor, q_band)
+    concert_list = {"concerts": [upcoming.format_entry(e, req.host_url) for e in entries]}
+    page_args = f"limit={q_limit}"
+    if q_band is not None:
+        page_args += f"&band={q_band}"
+    concert_list["self"] = f"{req.base_url}?{page_args}"
+    if q_cursor:
+        concert_list["self"] += f"&cursor={q_cursor}"
+    if next_cursor:
+        concert_list["next"] = f"{req.base_url}?{page_args}&cursor={next_cursor.decode('utf-8')}"
+    res = make_response(json.dumps(concert_list))
+    res.headers.set("Content-type", "application/json")
+    res.status_code = 200
+    return res
+
+
+def rebuild_upcoming(req):
+    # Only App Engine cron may trigger a full rebuild (header is stripped from external requests)
+    if req.headers.get("X-Appengine-Cron") != "true":
+        return ('', 403)
+    upcoming.rebuild()
     return ('', 204)
 
 
 @bp.route('', methods=['POST', 'GET'])
 def post_get_concerts():
     if request.method == 'POST':
-        return create_concert(request)
+        return idempotency.handle(
+            request, lambda: create_concert(request), lambda concert_id: resume_create_concert(concert_id, request))
     elif request.method == 'GET':
         return get_all_concerts(request)
     else:
@@ -334,3 +497,21 @@ def get_patch_delete_concert(concert_id):
     else:
         allowed_methods = 'GET, PATCH, DELETE'
         return invalid_method_response(allowed_methods)
+
+
+@bp.route('/upcoming', methods=['GET'])
+def get_upcoming_concerts():
+    if request.method == 'GET':
+        return get_upcoming(request)
+    else:
+        allowed_methods = 'GET'
+        return invalid_method_response(allowed_methods)
+
+
+@bp.route('/upcoming/rebuild', methods=['GET'])
+def rebuild_upcoming_concerts():
+    if request.method == 'GET':
+        return rebuild_upcoming(request)
+    else:
+        allowed_methods = 'GET'
+        return invalid_method_response(allowed_methods)
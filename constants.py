@@ -1,4 +1,107 @@
 band = 'band'
 concert = 'concert'
 state = 'state'
-user = 'user'
\ No newline at end of file
+user = 'user'
+users_pg_limit = 100
+
+# Transactions are retried on contention this many times in total
+transaction_attempts = 4
+transaction_backoff_seconds = 0.05
+
+# Datastore limits on keys per lookup and mutations per commit
+lookup_batch_size = 1000
+mutation_batch_size = 500
+
+# Response compression
+compression_min_size = 1024
+compression_level = 6
+
+# Cache-Control policies applied to successful GET responses, matched by
+# blueprint endpoint name (first match wins)
+cache_control_policies = [
+    ('users.post_get_user_concerts', 'private, no-cache'),
+    ('users.get_user_upcoming_concerts', 'private, no-cache'),
+    ('users.get_user_stats', 'private, no-cache'),
+    ('concerts.rebuild_upcoming_concerts', 'no-store'),
+    ('changes.', 'no-cache'),
+    ('search.', 'public, max-age=30, s-maxage=60'),
+    ('bands.', 'public, max-age=30, s-maxage=60'),
+    ('concerts.', 'public, max-age=30, s-maxage=60'),
+]
+
+# Materialized view of upcoming concerts
+upcoming = 'upcoming_concert'
+
+# Idempotency-Key support for POST requests
+idempotency = 'idempotency_key'
+idempotency_ttl_hours = 24
+idempotency_lease_seconds = 30
+idempotency_max_key_length = 255
+
+# Change feed. Entries newer than changes_settle_seconds are held back so a
+# write that commits late with an earlier sequence number is not skipped.
+# Sequence numbers are drawn inside each commit attempt, so the window must
+# exceed the longest single attempt (one lookup plus the commit RPC), not the
+# whole retry loop
+change = 'change'
+changes_pg_limit = 100
+changes_poll_seconds = 2
+changes_settle_seconds = 2
+changes_stream_seconds = 50
+changes_max_streams = 8
+changes_batch_size = 200
+
+# Search index
+search_doc = 'search_doc'
+search_max_prefix = 20
+search_max_terms = 5
+search_pg_limit = 100
+search_field_weights = {
+    'name': 5,
+    'genre': 3,
+    'members': 2,
+    'venue': 4,
+    'address': 1,
+}
+
+# Compact concert id lists on band and user entities
+concert_shard = 'concert_shard'
+concert_list_inline_max = 1000
+concert_list_shard_size = 1000
+
+# Read consistency per route ('strong' or 'eventual'). Eventual reads are served
+# from an in-process snapshot refreshed in the background once it is older than
+# snapshot_ttl_seconds; snapshots older than snapshot_max_stale_seconds are
+# reloaded synchronously. At most snapshot_max_entries snapshots are kept, least
+# recently used first out
+read_consistency = {
+    'bands.list': 'eventual',
+    'bands.count': 'eventual',
+    'concerts.list': 'eventual',
+    'concerts.count': 'eventual',
+}
+snapshot_ttl_seconds = 5
+snapshot_max_stale_seconds = 60
+snapshot_max_entries = 256
+
+# Sampled request profiling (disabled when the sample rate is 0). The
+# PROFILE_SAMPLE_RATE, PROFILE_BACKEND, PROFILE_OUTPUT_DIR and
+# PROFILE_ADMIN_TOKEN environment variables override these values. The
+# pyinstrument backend writes speedscope files; cprofile writes pstats files.
+# On App Engine only /tmp is writable for PROFILE_OUTPUT_DIR
+profile_sample_rate = 0.0
+profile_backend = 'cprofile'
+profile_output_dir = None
+profile_top_functions = 25
+
+# Per-user attendance aggregates
+user_stats = 'user_stats'
+
+# One row per (user, concert) with denormalized concert details, so a user's
+# upcoming concerts and a concert's attendees are index queries
+attendance = 'attendance'
+
+# Login path: buffer Google profile name changes and write them in batches
+login_write_behind = False
+login_flush_seconds = 5
+login_flush_batch_size = 500
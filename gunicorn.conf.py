@@ -0,0 +1,26 @@
+# Production serving profile (see app.yaml entrypoint). Handlers mostly wait on
+# datastore RPCs, but a single vCPU saturates at about 8 concurrent requests:
+# benchmarks/load_test.py against benchmarks/fake_app.py (snapshots off, 20 ms
+# per RPC, list, detail and search routes) levels off near 90 req/s from 8
+# clients, after which only latency grows, and more threads or a second worker
+# do not raise it. One worker covers the instance. Its threads are split
+# between ordinary requests and SSE streams (/changes/stream), which hold a
+# thread for up to constants.changes_stream_seconds and are capped at
+# constants.changes_max_streams per process. Keep workers * threads equal to
+# max_concurrent_requests in app.yaml.
+import os
+
+
+bind = f":{os.environ.get('PORT', '8080')}"
+worker_class = "gthread"
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+# App Engine enforces its own request deadline
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "0"))
+keepalive = 75
+graceful_timeout = 10
+max_requests = 10000
+max_requests_jitter = 1000
+# Clients are built lazily after fork, so the app can be imported before forking
+preload_app = True
+accesslog = "-"
@@ -0,0 +1,154 @@
+from flask import g, make_response
+import datetime
+import hashlib
+import json
+import clients
+import constants
+
+
+ds_client = clients.ds_client
+stored_properties = ("fingerprint", "status", "body", "content_type", "resource")
+
+
+def error_response(message, status_code):
+    res = make_response(json.dumps({"Error": message}))
+    res.headers.set("Content-type", "application/json")
+    res.status_code = status_code
+    return res
+
+
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def record_key(req, idem_key):
+    # Scope keys to the route and caller so a key can't replay another user's response
+    scope = "|".join([req.path, req.headers.get("Authorization", ""), idem_key])
+    return ds_client.key(constants.idempotency, hashlib.sha256(scope.encode("utf-8")).hexdigest())
+
+
+def request_fingerprint(req):
+    digest = hashlib.sha256()
+    digest.update(req.method.encode("utf-8"))
+    digest.update(req.get_data())
+    return digest.hexdigest()
+
+
+def is_claimable(record, fingerprint, now):
+    # Expired records and abandoned leases can be taken over; a committed record
+    # can only be taken over by a retry of the same request, to resume it
+    if record["expires_at"] < now:
+        return True
+    if record["state"] == "complete" or record["lease_expires_at"] >= now:
+        return False
+    return record["state"] == "pending" or record["fingerprint"] == fingerprint
+
+
+def claim(key, fingerprint):
+    # Return (record, claimed); a claimed record is a lease held by this request
+    now = utcnow()
+    record = ds_client.get(key)
+    if record is not None and not is_claimable(record, fingerprint, now):
+        return record, False
+
+    def take_lease():
+        record = ds_client.get(key)
+        if record is not None and not is_claimable(record, fingerprint, now):
+            return record, False
+        if record is None or record["expires_at"] < now or record["state"] == "pending":
+            # expires_at can be used as a datastore TTL policy property for cleanup
+            record = clients.new_entity(key=key, exclude_from_indexes=stored_properties)
+            record.update({
+                "state": "pending",
+                "fingerprint": fingerprint,
+                "expires_at": now + datetime.timedelta(hours=constants.idempotency_ttl_hours)
+            })
+        record["lease_expires_at"] = now + datetime.timedelta(seconds=constants.idempotency_lease_seconds)
+        ds_client.put(record)
+        return record, True
+    return clients.run_in_transaction(take_lease)
+
+
+def committed(resource):
+    # Entities for a handler to include in its primary commit, marking the key as
+    # committed so a retry resumes the side effects instead of repeating the write
+    lease = g.get("idempotency_lease")
+    if lease is None:
+        return []
+    record = clients.new_entity(key=lease.key, exclude_from_indexes=stored_properties)
+    record.update(lease)
+    record["state"] = "committed"
+    record["resource"] = json.dumps(resource)
+    return [record]
+
+
+def release(key):
+    # Forget the key unless the primary write committed; then let a retry resume now
+    def release_lease():
+        record = ds_client.get(key)
+        if record is None:
+            return
+        if record["state"] == "committed":
+            record["lease_expires_at"] = utcnow()
+            ds_client.put(record)
+        else:
+            ds_client.delete(key)
+    clients.run_in_transaction(release_lease)
+
+
+def complete(key, fingerprint, res):
+    record = clients.new_entity(key=key, exclude_from_indexes=stored_properties)
+    record.update({
+        "state": "complete",
+        "fingerprint": fingerprint,
+        "status": res.status_code,
+        "body": res.get_data(as_text=True),
+        "content_type": res.headers.get("Content-type", "application/json"),
+        "expires_at": utcnow() + datetime.timedelta(hours=constants.idempotency_ttl_hours)
+    })
+    ds_client.put(record)
+
+
+def replay(record):
+    res = make_response(record["body"])
+    if record["content_type"]:
+        res.headers.set("Content-type", record["content_type"])
+    res.headers.set("Idempotent-Replayed", "true")
+    res.status_code = record["status"]
+    return res
+
+
+def handle(req, handler, resume):
+    # resume(resource) finishes a request whose primary write was committed by an
+    # earlier attempt with the same key, and returns its response
+    idem_key = req.headers.get("Idempotency-Key")
+    if idem_key is None:
+        return handler()
+    if len(idem_key) == 0 or len(idem_key) > constants.idempotency_max_key_length:
+        return error_response("Idempotency-Key must be between 1 and 255 characters", 400)
+    key = record_key(req, idem_key)
+    fingerprint = request_fingerprint(req)
+    record, claimed = claim(key, fingerprint)
+    if not claimed:
+        if record["fingerprint"] != fingerprint:
+            return error_response("Idempotency-Key was already used with a different request", 422)
+        if record["state"] != "complete":
+            res = error_response("A request with this Idempotency-Key is still in progress", 409)
+            res.headers.set("Retry-After", "1")
+            return res
+        return replay(record)
+    # Run the handler, or resume it if an earlier attempt committed, and store the result
+    g.idempotency_lease = record
+    try:
+        if record["state"] == "committed":
+            res = make_response(resume(json.loads(record["resource"])))
+        else:
+            res = make_response(handler())
+    except Exception:
+        release(key)
+        raise
+    if res.status_code >= 500:
+        release(key)
+    else:
+        complete(key, fingerprint, res)
+    return res
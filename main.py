@@ -1,26 +1,34 @@
 from flask import Flask, render_template, request, redirect, url_for
-from google.auth import jwt
-from google.cloud import datastore
-import google.oauth2.credentials
-import google_auth_oauthlib.flow
 import bands
+import changes
+import clients
+import concert_lists
 import concerts
 import constants
+import datetime
+import middleware
+import profiling
 import random
+import search
 import string
 import users
+import write_behind
 
 
 app = Flask(__name__)
-ds_client = datastore.Client()
+ds_client = clients.ds_client
 app.register_blueprint(bands.bp)
 app.register_blueprint(concerts.bp)
 app.register_blueprint(users.bp)
+app.register_blueprint(changes.bp)
+app.register_blueprint(search.bp)
+middleware.init_app(app)
+profiling.init_app(app)
 
 
 def store_state(state):
-    new_state = datastore.entity.Entity(key=ds_client.key(constants.state))
-    new_state.update({'value': state})
+    new_state = clients.new_entity(key=ds_client.key(constants.state, state))
+    new_state.update({'value': state, 'created': datetime.datetime.now(datetime.timezone.utc)})
     ds_client.put(new_state)
 
 
@@ -31,20 +39,13 @@ def generate_new_state():
 
 
 def validate_state(state):
-    query = ds_client.query(kind=constants.state)
-    state_list = list(query.fetch())
-    for s in state_list:
-        if s['value'] == state:
-            return True
-    return False
+    if not state:
+        return False
+    return ds_client.get(ds_client.key(constants.state, state)) is not None
 
 
 def get_jwt_token(state):
-    flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
-        'client_secret.json',
-        scopes=['https://www.googleapis.com/auth/userinfo.profile'],
-        state=state
-    )
+    flow = clients.new_oauth_flow(state=state)
     flow.redirect_uri = url_for('home', _external=True)
     authorization_response = request.url
     flow.fetch_token(authorization_response=authorization_response)
@@ -53,6 +54,7 @@ def get_jwt_token(state):
 
 
 def get_user_info(jwt_token):
+    from google.auth import jwt
     decoded_jwt = jwt.decode(jwt_token, verify=False)
     user_info = {
         'f_name': decoded_jwt['given_name'],
@@ -66,20 +68,47 @@ def update_user(user, user_info):
     user.update({
         'f_name': user_info['f_name'],
         'l_name': user_info['l_name'],
-        'user_id': user_info['user_id'],
-        'concerts': []
+        'user_id': user_info['user_id']
     })
-
-
-def store_user(user_info):
-    query = ds_client.query(kind=constants.user)
-    user_list = list(query.fetch())
-    for user in user_list:
-        if user['user_id'] == user_info['user_id']:
-            return
-    new_user = datastore.entity.Entity(key=ds_client.key(constants.user))
-    update_user(new_user, user_info)
-    ds_client.put(new_user)
+    concert_lists.init_concert_ids(user)
+
+
+def profile_changed(user, user_info):
+    return user['f_name'] != user_info['f_name'] or user['l_name'] != user_info['l_name']
+
+
+def complete_login(state, user_info):
+    # Consume the state and get-or-insert the user in one transaction (retried on contention)
+    existing_user = users.find_user(user_info['user_id'])
+    if existing_user is not None:
+        user_key = existing_user.key
+    else:
+        user_key = ds_client.key(constants.user, user_info['user_id'])
+    state_key = ds_client.key(constants.state, state)
+
+    def consume_state():
+        # Returns (state_found, buffer_profile)
+        found = {entity.key: entity for entity in ds_client.get_multi([state_key, user_key])}
+        if state_key not in found:
+            return False, False  # state was already used by a concurrent request
+        ds_client.delete(state_key)
+        user = found.get(user_key)
+        if user is None:
+            user = clients.new_entity(key=user_key)
+            update_user(user, user_info)
+            ds_client.put(user)
+        elif profile_changed(user, user_info):
+            if constants.login_write_behind:
+                return True, True
+            user.update({'f_name': user_info['f_name'], 'l_name': user_info['l_name']})
+            ds_client.put(user)
+        return True, False
+    state_found, buffer_profile = clients.run_in_transaction(consume_state)
+    if not state_found:
+        return False
+    if buffer_profile:
+        write_behind.enqueue(user_key, {'f_name': user_info['f_name'], 'l_name': user_info['l_name']})
+    return True
 
 
 @app.route('/')
@@ -91,7 +120,8 @@ def home():
         return ('Error: Invalid state credential', 401)
     jwt_token = get_jwt_token(state)
     user_info = get_user_info(jwt_token)
-    store_user(user_info)  # user entity created if not already in datastore
+    if not complete_login(state, user_info):  # user entity created if not already in datastore
+        return ('Error: Invalid state credential', 401)
     return render_template(
         'user_info.html',
         f_name=user_info['f_name'],
@@ -101,13 +131,23 @@ def home():
     )
 
 
+@app.route('/_ah/warmup')
+def warmup():
+    # Build clients, load secrets and open the datastore channel before traffic arrives
+    query = ds_client.query(kind=constants.band)
+    query.keys_only()
+    list(query.fetch(limit=1))
+    clients.get_client_config()
+    clients.get_auth_request()
+    from google.oauth2 import id_token  # noqa: F401
+    import google_auth_oauthlib.flow  # noqa: F401
+    return ('', 200)
+
+
 @app.route('/oauth')
 def oauth_request():
     new_state = generate_new_state()
-    flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
-        'client_secret.json',
-        scopes=['https://www.googleapis.com/auth/userinfo.profile']
-    )
+    flow = clients.new_oauth_flow()
     flow.redirect_uri = url_for('home', _external=True)
     authorization_url, state = flow.authorization_url(
         access_type='offline',
@@ -0,0 +1,87 @@
+from flask import request
+import gzip
+import constants
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+def accepted_encodings(accept_encoding):
+    encodings = {}
+    for part in accept_encoding.split(","):
+        fields = part.strip().split(";")
+        name = fields[0].strip().lower()
+        quality = 1.0
+        for param in fields[1:]:
+            param = param.strip()
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if name:
+            encodings[name] = quality
+    return encodings
+
+
+def choose_encoding(accept_encoding):
+    encodings = accepted_encodings(accept_encoding)
+    if brotli is not None and encodings.get("br", 0) > 0:
+        return "br"
+    if encodings.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress_response(res):
+    if res.direct_passthrough or res.is_streamed:
+        return res
+    if res.status_code < 200 or res.status_code in (204, 304):
+        return res
+    if "Content-Encoding" in res.headers:
+        return res
+    res.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is None:
+        return res
+    body = res.get_data()
+    if len(body) < constants.compression_min_size:
+        return res
+    if encoding == "br":
+        body = brotli.compress(body, quality=constants.compression_level)
+    else:
+        body = gzip.compress(body, compresslevel=constants.compression_level)
+    res.set_data(body)
+    res.headers.set("Content-Encoding", encoding)
+    return res
+
+
+def cache_control_policy(endpoint):
+    if endpoint is None:
+        return None
+    for prefix, policy in constants.cache_control_policies:
+        if endpoint.startswith(prefix):
+            return policy
+    return None
+
+
+def set_cache_control(res):
+    if request.method != "GET" or res.status_code not in (200, 204):
+        return res
+    if "Cache-Control" in res.headers:
+        return res
+    policy = cache_control_policy(request.endpoint)
+    if policy is not None:
+        res.headers.set("Cache-Control", policy)
+        if policy.startswith("private"):
+            res.vary.add("Authorization")
+    return res
+
+
+def init_app(app):
+    @app.after_request
+    def apply_response_policies(res):
+        res = set_cache_control(res)
+        return compress_response(res)
@@ -0,0 +1,43 @@
+# Builds the attendance rows (one per user and attended concert) from each
+# user's concert list. Safe to re-run; each user's rows are recomputed and stale
+# rows dropped. Prints a cursor after each batch so an interrupted run can be
+# resumed. Run from the repository root:
+#     python migrations/backfill_attendance.py
+#     python migrations/backfill_attendance.py --cursor <cursor>
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import attendance  # noqa: E402
+import clients  # noqa: E402
+import constants  # noqa: E402
+
+
+def backfill(batch_size, cursor=None):
+    users = 0
+    rows = 0
+    while True:
+        query = clients.ds_client.query(kind=constants.user)
+        q_result = query.fetch(limit=batch_size, start_cursor=cursor)
+        for user in next(q_result.pages):
+            rows += attendance.rebuild_user(user)
+            users += 1
+        cursor = q_result.next_page_token
+        if not cursor:
+            break
+        print(f"{users} users, {rows} rows, resume with --cursor {cursor.decode('utf-8')}", flush=True)
+    print(f"done, {users} users, {rows} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill attendance rows")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--cursor", default=None)
+    args = parser.parse_args()
+    backfill(args.batch_size, args.cursor)
+
+
+if __name__ == "__main__":
+    main()
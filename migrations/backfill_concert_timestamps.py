@@ -0,0 +1,54 @@
+# Adds the native timestamp property to concerts stored before it existed and
+# normalizes their date to zero-padded MM-DD-YYYY. Safe to re-run; concerts that
+# already have a timestamp are skipped. Prints a cursor after each batch so an
+# interrupted run can be resumed. Run from the repository root:
+#     python migrations/backfill_concert_timestamps.py
+#     python migrations/backfill_concert_timestamps.py --cursor <cursor>
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import clients  # noqa: E402
+import concerts  # noqa: E402
+import constants  # noqa: E402
+
+
+def backfill(batch_size, cursor=None):
+    updated = 0
+    invalid = []
+    while True:
+        query = clients.ds_client.query(kind=constants.concert)
+        q_result = query.fetch(limit=batch_size, start_cursor=cursor)
+        batch = []
+        for concert in next(q_result.pages):
+            if concert.get("timestamp") is not None:
+                continue
+            if concerts.parse_concert_date(concert.get("date")) is None:
+                invalid.append(concert.key.id)
+                continue
+            concert.update(concerts.date_updates(concert["date"]))
+            batch.append(concert)
+        if batch:
+            clients.ds_client.put_multi(batch)
+            updated += len(batch)
+        cursor = q_result.next_page_token
+        if not cursor:
+            break
+        print(f"{updated} updated, resume with --cursor {cursor.decode('utf-8')}", flush=True)
+    print(f"done, {updated} updated")
+    if invalid:
+        print(f"concerts with unparseable dates (left unchanged): {invalid}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill concert timestamps")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--cursor", default=None)
+    args = parser.parse_args()
+    backfill(args.batch_size, args.cursor)
+
+
+if __name__ == "__main__":
+    main()
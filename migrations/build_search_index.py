@@ -0,0 +1,14 @@
+# Backfills the search index for bands and concerts created before it existed,
+# and reindexes documents written before whole tokens were indexed.
+# Run from the repository root:
+#     python migrations/build_search_index.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search  # noqa: E402
+
+
+if __name__ == "__main__":
+    print(f"Indexed {search.rebuild_index()} documents")
@@ -0,0 +1,46 @@
+# Converts band and user "concerts" lists from embedded {"id": int} entities to
+# the compact storage in concert_lists.py. Safe to re-run; already converted
+# entities are skipped. Prints a cursor after each batch so an interrupted run
+# can be resumed. Run from the repository root:
+#     python migrations/compact_concert_lists.py --kind band
+#     python migrations/compact_concert_lists.py --kind user --cursor <cursor>
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import clients  # noqa: E402
+import concert_lists  # noqa: E402
+import constants  # noqa: E402
+
+
+def migrate_kind(kind, batch_size, cursor=None):
+    total = 0
+    while True:
+        query = clients.ds_client.query(kind=kind)
+        q_result = query.fetch(limit=batch_size, start_cursor=cursor)
+        entities = list(next(q_result.pages))
+        total += concert_lists.migrate_entities(entities)
+        cursor = q_result.next_page_token
+        if not entities or not cursor:
+            break
+        print(f"{kind}: {total} converted, resume with --cursor {cursor.decode('utf-8')}", flush=True)
+    print(f"{kind}: done, {total} converted")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact embedded concert lists")
+    parser.add_argument("--kind", choices=[constants.band, constants.user], action="append")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--cursor", default=None)
+    args = parser.parse_args()
+    kinds = args.kind or [constants.band, constants.user]
+    if args.cursor and len(kinds) != 1:
+        parser.error("--cursor requires exactly one --kind")
+    for kind in kinds:
+        migrate_kind(kind, args.batch_size, args.cursor)
+
+
+if __name__ == "__main__":
+    main()
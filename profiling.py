@@ -0,0 +1,190 @@
+from flask import Blueprint, request, make_response, g
+import cProfile
+import datetime
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import constants
+
+
+bp = Blueprint('profiling', __name__, url_prefix='/admin/profiles')
+aggregates = {}
+aggregates_lock = threading.Lock()
+profile_backends = ("cprofile", "pyinstrument")
+active = {"backend": "cprofile"}
+
+
+def setting(env_name, default):
+    return os.environ.get(env_name, default)
+
+
+def sample_rate():
+    return float(setting("PROFILE_SAMPLE_RATE", constants.profile_sample_rate))
+
+
+def backend():
+    return active["backend"]
+
+
+def resolve_backend():
+    # Checked once at startup so a missing or unknown backend falls back to
+    # cProfile instead of failing every sampled request
+    name = setting("PROFILE_BACKEND", constants.profile_backend)
+    if name not in profile_backends:
+        logging.warning("unknown profiling backend %r; using cprofile", name)
+        return "cprofile"
+    if name == "pyinstrument":
+        try:
+            import pyinstrument  # noqa: F401
+        except ImportError:
+            logging.warning("pyinstrument is not installed; using cprofile")
+            return "cprofile"
+    return name
+
+
+def start_profile():
+    if random.random() >= sample_rate():
+        return
+    if backend() == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    g.profiler = profiler
+    g.profile_started = time.perf_counter()
+
+
+def write_profile(profiler, endpoint):
+    output_dir = setting("PROFILE_OUTPUT_DIR", constants.profile_output_dir)
+    if not output_dir:
+        return
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    # A profile that can't be written (e.g. a read-only directory outside /tmp on
+    # App Engine) is logged and dropped rather than failing the request
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        if backend() == "pyinstrument":
+            from pyinstrument.renderers import SpeedscopeRenderer
+            path = os.path.join(output_dir, f"{endpoint}-{stamp}.speedscope.json")
+            with open(path, "w") as profile_file:
+                profile_file.write(profiler.output(SpeedscopeRenderer()))
+        else:
+            profiler.dump_stats(os.path.join(output_dir, f"{endpoint}-{stamp}.prof"))
+    except OSError:
+        logging.exception("could not write profile for %s to %s", endpoint, output_dir)
+
+
+def stop_profile(exc):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+    elapsed = time.perf_counter() - g.pop("profile_started")
+    endpoint = request.endpoint or "unmatched"
+    if backend() == "pyinstrument":
+        profiler.stop()
+        stats = None
+    else:
+        profiler.disable()
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+    with aggregates_lock:
+        aggregate = aggregates.setdefault(endpoint, {"samples": 0, "total_seconds": 0.0, "stats": None})
+        aggregate["samples"] += 1
+        aggregate["total_seconds"] += elapsed
+        if stats is not None:
+            if aggregate["stats"] is None:
+                aggregate["stats"] = stats
+            else:
+                aggregate["stats"].add(stats)
+    write_profile(profiler, endpoint)
+
+
+def top_functions(stats, limit):
+    functions = []
+    for (filename, line, name), (cc, nc, tt, ct, callers) in stats.stats.items():
+        functions.append({
+            "function": f"{filename}:{line}({name})",
+            "calls": nc,
+            "own_seconds": round(tt, 6),
+            "cumulative_seconds": round(ct, 6)
+        })
+    functions.sort(key=lambda f: f["cumulative_seconds"], reverse=True)
+    return functions[:limit]
+
+
+def validate_admin_token(req):
+    # The admin endpoint only exists when PROFILE_ADMIN_TOKEN is configured
+    admin_token = os.environ.get("PROFILE_ADMIN_TOKEN")
+    if not admin_token:
+        return ('', 404)
+    auth_header = req.headers.get("Authorization", "").split()
+    if len(auth_header) != 2 or auth_header[0] != "Bearer" or \
+            not hmac.compare_digest(auth_header[1], admin_token):
+        res = make_response(json.dumps({"Error": "This resource is restricted to administrators"}))
+        res.headers.set("Content-type", "application/json")
+        res.status_code = 401
+        return res
+    return None
+
+
+def get_profiles(req):
+    auth_err = validate_admin_token(req)
+    if auth_err is not None:
+        return auth_err
+    limit = int(req.args.get("limit", str(constants.profile_top_functions)))
+    only_endpoint = req.args.get("endpoint")
+    profiles = {}
+    with aggregates_lock:
+        for endpoint, aggregate in aggregates.items():
+            if only_endpoint is not None and endpoint != only_endpoint:
+                continue
+            profiles[endpoint] = {
+                "samples": aggregate["samples"],
+                "mean_seconds": round(aggregate["total_seconds"] / aggregate["samples"], 6),
+                "functions": [] if aggregate["stats"] is None else top_functions(aggregate["stats"], limit)
+            }
+    body = {"sample_rate": sample_rate(), "backend": backend(), "profiles": profiles}
+    res = make_response(json.dumps(body))
+    res.headers.set("Content-type", "application/json")
+    res.headers.set("Cache-Control", "no-store")
+    res.status_code = 200
+    return res
+
+
+def reset_profiles(req):
+    auth_err = validate_admin_token(req)
+    if auth_err is not None:
+        return auth_err
+    with aggregates_lock:
+        aggregates.clear()
+    return ('', 204)
+
+
+@bp.route('', methods=['GET', 'DELETE'])
+def get_delete_profiles():
+    if request.method == 'GET':
+        return get_profiles(request)
+    elif request.method == 'DELETE':
+        return reset_profiles(request)
+    else:
+        res = make_response()
+        res.headers.set("Allow", 'GET, DELETE')
+        res.status_code = 405
+        return res
+
+
+def init_app(app):
+    app.register_blueprint(bp)
+    # No hooks are installed when sampling is off, so disabled profiling costs nothing per request
+    if sample_rate() <= 0:
+        return
+    active["backend"] = resolve_backend()
+    app.before_request(start_profile)
+    app.teardown_request(stop_profile)
@@ -0,0 +1,205 @@
+from flask import Blueprint, request, make_response
+import json
+import re
+import urllib.parse
+import clients
+import constants
+
+
+ds_client = clients.ds_client
+bp = Blueprint('search', __name__, url_prefix='/search')
+pg_limit = 5
+resource_paths = {constants.band: "bands/", constants.concert: "concerts/"}
+
+
+def invalid_method_response(allowed_methods):
+    res = make_response()
+    res.headers.set("Allow", allowed_methods)
+    res.status_code = 405
+    return res
+
+
+def validate_accept_header_json(req_headers):
+    accept_err = {"Error": "Requests must accept response Content-type of application/json"}
+    accept_headers = req_headers.get("Accept").replace(";", ",")
+    accept_headers = accept_headers.split(",")
+    for header in accept_headers:
+        header = header.strip()
+    if "application/json" not in accept_headers and "*/*" not in accept_headers:
+        res = make_response(json.dumps(accept_err))
+        res.headers.set("Content-type", "application/json")
+        res.status_code = 406
+        return res
+    return None
+
+
+def tokenize(value):
+    if isinstance(value, (list, tuple)):
+        value = " ".join(str(v) for v in value)
+    return re.findall(r"\w+", str(value).lower())
+
+
+def token_prefixes(tokens):
+    prefixes = set()
+    for token in tokens:
+        for i in range(1, min(len(token), constants.search_max_prefix) + 1):
+            prefixes.add(token[:i])
+    return sorted(prefixes)
+
+
+def doc_key(kind, ref_id):
+    return ds_client.key(constants.search_doc, f"{kind}:{int(ref_id)}")
+
+
+def index_document(kind, ref_id, title, fields):
+    field_tokens = {field: tokenize(value) for field, value in fields.items()}
+    all_tokens = [token for tokens in field_tokens.values() for token in tokens]
+    doc = clients.new_entity(key=doc_key(kind, ref_id), exclude_from_indexes=("title", "fields"))
+    doc.update({
+        "type": kind,
+        "ref_id": int(ref_id),
+        "title": str(title),
+        "fields": json.dumps(field_tokens),
+        "tokens": sorted(set(all_tokens)),
+        "prefixes": token_prefixes(all_tokens)
+    })
+    ds_client.put(doc)
+
+
+def index_band(band):
+    fields = {"name": band["name"], "genre": band["genre"], "members": band["members"]}
+    index_document(constants.band, band.key.id, band["name"], fields)
+
+
+def index_concert(concert):
+    fields = {"venue": concert["venue"], "address": concert["address"]}
+    index_document(constants.concert, concert.key.id, concert["venue"], fields)
+
+
+def remove_documents(kind, ref_ids):
+    clients.delete_multi([doc_key(kind, ref_id) for ref_id in ref_ids])
+
+
+def rebuild_index():
+    # Index every existing band and concert (used to backfill the index)
+    count = 0
+    for band in ds_client.query(kind=constants.band).fetch():
+        index_band(band)
+        count += 1
+    for concert in ds_client.query(kind=constants.concert).fetch():
+        index_concert(concert)
+        count += 1
+    return count
+
+
+def score_document(doc, terms):
+    field_tokens = json.loads(doc["fields"])
+    score = 0
+    for term in terms:
+        for field, tokens in field_tokens.items():
+            weight = constants.search_field_weights.get(field, 1)
+            if term in tokens:
+                score += 2 * weight
+            elif any(token.startswith(term) for token in tokens):
+                score += weight
+    return score
+
+
+def match_query(terms, doc_type, exact):
+    # Equality filters on the indexed tokens or prefixes list are merge-joined by
+    # datastore so no full scan is needed
+    query = ds_client.query(kind=constants.search_doc)
+    for term in terms:
+        if exact:
+            query.add_filter("tokens", "=", term)
+        else:
+            query.add_filter("prefixes", "=", term[:constants.search_max_prefix])
+    if doc_type is not None:
+        query.add_filter("type", "=", doc_type)
+    return query
+
+
+def is_exact_match(doc, terms):
+    tokens = set(doc.get("tokens") or [])
+    return all(term in tokens for term in terms)
+
+
+def find_documents(q, doc_type, limit, cursor=None):
+    # Documents where every term is a whole token are returned first, then those
+    # where some term only prefix-matches; each phase is paged with a datastore
+    # cursor so no match is cut. Results are ranked within the page. Returns the
+    # ranked (score, doc) pairs and the cursor for the next page, if any
+    terms = tokenize(q)[:constants.search_max_terms]
+    if not terms:
+        return [], None
+    phase, _, start = (cursor or "exact:").partition(":")
+    docs = []
+    while len(docs) < limit:
+        exact = phase == "exact"
+        q_result = match_query(terms, doc_type, exact).fetch(limit=limit - len(docs), start_cursor=start or None)
+        page = list(next(q_result.pages))
+        docs.extend(page if exact else [doc for doc in page if not is_exact_match(doc, terms)])
+        if q_result.next_page_token:
+            start = q_result.next_page_token.decode("utf-8")
+        elif exact:
+            phase, start = "prefix", ""
+        else:
+            phase = None
+            break
+    results = [(score_document(doc, terms), doc) for doc in docs]
+    results.sort(key=lambda result: (-result[0], result[1]["title"].lower(), result[1]["ref_id"]))
+    next_cursor = f"{phase}:{start}" if phase is not None else None
+    return results, next_cursor
+
+
+def search_catalog(req):
+    # Validate request headers and query parameters
+    accept_err = validate_accept_header_json(req.headers)
+    if accept_err is not None:
+        return accept_err
+    q = req.args.get("q", "")
+    doc_type = req.args.get("type")
+    if doc_type is not None and doc_type not in resource_paths:
+        res = make_response(json.dumps({"Error": "type must be band or concert"}))
+        res.headers.set("Content-type", "application/json")
+        res.status_code = 400
+        return res
+    q_cursor = req.args.get("cursor")
+    if q_cursor is not None and q_cursor.partition(":")[0] not in ("exact", "prefix"):
+        res = make_response(json.dumps({"Error": "cursor is not valid"}))
+        res.headers.set("Content-type", "application/json")
+        res.status_code = 400
+        return res
+    # Retrieve and return one page of ranked results
+    q_limit = min(int(req.args.get("limit", str(pg_limit))), constants.search_pg_limit)
+    results, next_cursor = find_documents(q, doc_type, q_limit, q_cursor)
+    result_list = {"results": []}
+    for score, doc in results:
+        result_list["results"].append({
+            "type": doc["type"],
+            "id": doc["ref_id"],
+            "title": doc["title"],
+            "score": score,
+            "self": req.host_url + resource_paths[doc["type"]] + str(doc["ref_id"])
+        })
+    page_args = "q=" + urllib.parse.quote(q)
+    if doc_type is not None:
+        page_args += f"&type={doc_type}"
+    result_list["self"] = f"{req.base_url}?{page_args}&limit={q_limit}"
+    if q_cursor:
+        result_list["self"] += "&cursor=" + urllib.parse.quote(q_cursor)
+    if next_cursor:
+        result_list["next"] = f"{req.base_url}?{page_args}&limit={q_limit}&cursor=" + urllib.parse.quote(next_cursor)
+    res = make_response(json.dumps(result_list))
+    res.headers.set("Content-type", "application/json")
+    res.status_code = 200
+    return res
+
+
+@bp.route('', methods=['GET'])
+def get_search():
+    if request.method == 'GET':
+        return search_catalog(request)
+    else:
+        allowed_methods = 'GET'
+        return invalid_method_response(allowed_methods)
@@ -0,0 +1,76 @@
+import collections
+import threading
+import time
+import constants
+
+
+# Short-lived in-process snapshots of list/count reads for routes configured for
+# eventual consistency. Writes on this instance invalidate their namespace so a
+# client never reads a snapshot older than its own write. Keys include request
+# arguments, so the cache is an LRU capped at snapshot_max_entries and entries
+# past snapshot_max_stale_seconds are dropped whenever a snapshot is stored.
+snapshots = collections.OrderedDict()
+generations = {}
+lock = threading.Lock()
+
+
+def is_eventual(route):
+    return constants.read_consistency.get(route, 'strong') == 'eventual'
+
+
+def invalidate(*namespaces):
+    with lock:
+        for namespace in namespaces:
+            generations[namespace] = generations.get(namespace, 0) + 1
+            for key in [k for k in snapshots if k[0] == namespace]:
+                del snapshots[key]
+
+
+def evict(now):
+    # Call with lock held
+    max_stale = constants.snapshot_max_stale_seconds
+    for key in [k for k, s in snapshots.items() if now - s["loaded_at"] >= max_stale]:
+        del snapshots[key]
+    while len(snapshots) > constants.snapshot_max_entries:
+        snapshots.popitem(last=False)
+
+
+def store(key, value, generation):
+    with lock:
+        if generations.get(key[0], 0) == generation:
+            now = time.monotonic()
+            snapshots[key] = {"value": value, "loaded_at": now, "refreshing": False}
+            snapshots.move_to_end(key)
+            evict(now)
+
+
+def refresh(key, loader, generation):
+    try:
+        store(key, loader(), generation)
+    except Exception:
+        with lock:
+            if key in snapshots:
+                snapshots[key]["refreshing"] = False
+
+
+def read(route, namespace, key, loader):
+    # Return loader() for strong routes, otherwise a snapshot of it
+    if not is_eventual(route):
+        return loader()
+    key = (namespace, route) + tuple(key)
+    with lock:
+        generation = generations.get(namespace, 0)
+        snapshot = snapshots.get(key)
+        if snapshot is not None:
+            snapshots.move_to_end(key)
+            age = time.monotonic() - snapshot["loaded_at"]
+            if age < constants.snapshot_ttl_seconds:
+                return snapshot["value"]
+            if age < constants.snapshot_max_stale_seconds:
+                if not snapshot["refreshing"]:
+                    snapshot["refreshing"] = True
+                    threading.Thread(target=refresh, args=(key, loader, generation), daemon=True).start()
+                return snapshot["value"]
+    value = loader()
+    store(key, value, generation)
+    return value
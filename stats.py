@@ -0,0 +1,156 @@
+import attendance
+import clients
+import concert_lists
+import constants
+
+
+# Each user has one user_stats entity (keyed by user_id) holding attendance
+# counts per band, genre and year. Counts are adjusted incrementally as concerts
+# are added to or removed from the user, and when an attended concert or band
+# changes; a user without stats yet is rebuilt from their concert list.
+ds_client = clients.ds_client
+buckets = ("bands", "genres", "years")
+
+
+def stats_key(user_id):
+    return ds_client.key(constants.user_stats, user_id)
+
+
+def concert_year(concert):
+    return str(int(concert["date"].split("-")[2]))
+
+
+def contribution(concert, band):
+    return {
+        "bands": str(concert["band"]["id"]),
+        "genres": band["genre"] if band is not None else "unknown",
+        "years": concert_year(concert)
+    }
+
+
+def concert_contributions(concert_ids):
+    concert_keys = [ds_client.key(constants.concert, int(cid)) for cid in concert_ids]
+    concert_list = clients.get_multi(concert_keys)
+    band_keys = list(set(ds_client.key(constants.band, int(c["band"]["id"])) for c in concert_list))
+    band_map = {band.key.id: band for band in clients.get_multi(band_keys)}
+    return [contribution(c, band_map.get(int(c["band"]["id"]))) for c in concert_list]
+
+
+def new_stats(user_id):
+    user_stats = clients.new_entity(key=stats_key(user_id), exclude_from_indexes=buckets)
+    user_stats["concert_count"] = 0
+    for bucket in buckets:
+        user_stats[bucket] = {}
+    return user_stats
+
+
+def apply_contributions(user_stats, contributions, sign):
+    for item in contributions:
+        user_stats["concert_count"] += sign
+        for bucket in buckets:
+            counts = dict(user_stats[bucket])
+            counts[item[bucket]] = counts.get(item[bucket], 0) + sign
+            if counts[item[bucket]] <= 0:
+                del counts[item[bucket]]
+            user_stats[bucket] = counts
+
+
+def build(user):
+    # Call inside a transaction; reads the stored concert list so a concurrent
+    # change to it conflicts and is retried rather than lost
+    stored_user = ds_client.get(user.key) or user
+    user_stats = new_stats(user["user_id"])
+    apply_contributions(user_stats, concert_contributions(concert_lists.get_concert_ids(stored_user)), 1)
+    return user_stats
+
+
+def rebuild(user):
+    def rebuild_stats():
+        user_stats = build(user)
+        ds_client.put(user_stats)
+        return user_stats
+    return clients.run_in_transaction(rebuild_stats)
+
+
+def update(user, contributions, sign):
+    # Apply a change that is already reflected in the user's concert list
+    if not contributions:
+        return
+    key = stats_key(user["user_id"])
+
+    def apply():
+        user_stats = ds_client.get(key)
+        if user_stats is None:
+            # Missing (new or reset) stats are rebuilt, which includes this change
+            user_stats = build(user)
+        else:
+            apply_contributions(user_stats, contributions, sign)
+        ds_client.put(user_stats)
+    clients.run_in_transaction(apply)
+
+
+def add_concerts(user, concert_ids):
+    update(user, concert_contributions(concert_ids), 1)
+
+
+def remove_concerts(user, concert_ids):
+    # Call before the concerts themselves are deleted
+    update(user, concert_contributions(concert_ids), -1)
+
+
+def replace_contribution(user, old, new):
+    if old != new:
+        update(user, [old], -1)
+        update(user, [new], 1)
+
+
+def reset(user_id):
+    # Drop the user's stats so the next read rebuilds them from the concert list
+    ds_client.delete(stats_key(user_id))
+
+
+def get_stats(user):
+    user_stats = ds_client.get(stats_key(user["user_id"]))
+    if user_stats is None:
+        user_stats = rebuild(user)
+    return user_stats
+
+
+def change_band_genre(band_id, old_genre, new_genre):
+    # Move each attending user's count for this band from the old genre to the new one
+    if old_genre == new_genre:
+        return
+    stats_keys = [stats_key(user_id) for user_id in attendance.band_user_ids(band_id)]
+
+    def move_counts(keys):
+        changed = []
+        for user_stats in ds_client.get_multi(keys):
+            count = user_stats["bands"].get(str(band_id), 0)
+            if count == 0:
+                continue
+            genres = dict(user_stats["genres"])
+            genres[old_genre] = genres.get(old_genre, 0) - count
+            if genres[old_genre] <= 0:
+                del genres[old_genre]
+            genres[new_genre] = genres.get(new_genre, 0) + count
+            user_stats["genres"] = genres
+            changed.append(user_stats)
+        if changed:
+            ds_client.put_multi(changed)
+    # Each batch is a read-modify-write transaction so concurrent updates retry
+    for keys in clients.chunks(stats_keys, constants.mutation_batch_size):
+        clients.run_in_transaction(lambda keys=keys: move_counts(keys))
+
+
+def format_stats(user_stats, host_url, self_url):
+    band_counts = sorted(user_stats["bands"].items(), key=lambda item: (-item[1], int(item[0])))
+    return {
+        "concert_count": user_stats["concert_count"],
+        "bands": [
+            {"id": int(band_id), "count": count, "self": host_url + "bands/" + band_id}
+            for band_id, count in band_counts
+        ],
+        "genres": dict(user_stats["genres"]),
+        "years": dict(sorted(user_stats["years"].items())),
+        "self": self_url
+    }
@@ -0,0 +1,37 @@
+import os
+import sys
+import pytest
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import clients  # noqa: E402
+import fake_datastore  # noqa: E402
+import main  # noqa: E402
+import snapshots  # noqa: E402
+import users  # noqa: E402
+
+
+json_headers = {"Accept": "application/json", "Content-type": "application/json"}
+
+
+@pytest.fixture
+def ds(monkeypatch):
+    fake = fake_datastore.FakeDatastoreClient()
+    monkeypatch.setattr(clients.ds_client, "_client", fake)
+    snapshots.invalidate(*[k[0] for k in list(snapshots.snapshots)])
+    return fake
+
+
+@pytest.fixture
+def client(ds):
+    main.app.config["TESTING"] = True
+    return main.app.test_client()
+
+
+@pytest.fixture
+def login_as(monkeypatch):
+    def login(user_id):
+        monkeypatch.setattr(users, "get_id_from_jwt", lambda req: user_id)
+    return login
@@ -0,0 +1,222 @@
+import base64
+import copy
+import itertools
+import threading
+import time
+from google.api_core import exceptions
+from google.cloud.datastore import Entity, Key
+
+
+# In-memory stand-in for google.cloud.datastore.Client covering the calls the
+# app makes. It enforces the service's 1000-key lookup and 500-mutation commit
+# limits. Pass latency (seconds) to simulate the RPC round trip of each call.
+project = "test-project"
+max_lookup_keys = 1000
+max_commit_mutations = 500
+
+
+def copy_entity(entity):
+    result = Entity(key=entity.key, exclude_from_indexes=tuple(entity.exclude_from_indexes))
+    for name, value in entity.items():
+        result[name] = copy.deepcopy(value)
+    return result
+
+
+def key_sort_value(key):
+    return tuple((part.get("kind"), str(part.get("id", part.get("name")))) for part in key.path)
+
+
+class FakeTransaction:
+
+    def __init__(self, client):
+        self.client = client
+        self.puts = {}
+        self.deletes = set()
+
+    def __enter__(self):
+        self.client.local.transaction = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.client.local.transaction = None
+        if exc_type is None:
+            self.client.commit(list(self.puts.values()), list(self.deletes))
+        return False
+
+
+class FakeIterator:
+
+    def __init__(self, results, next_page_token):
+        self.results = results
+        self.next_page_token = next_page_token
+
+    @property
+    def pages(self):
+        return iter([iter(self.results)])
+
+    def __iter__(self):
+        return iter(self.results)
+
+
+class FakeQuery:
+
+    def __init__(self, client, kind):
+        self.client = client
+        self.kind = kind
+        self.filters = []
+        self.order = []
+        self.projection = []
+        self.is_keys_only = False
+
+    def add_filter(self, name, op, value):
+        self.filters.append((name, op, value))
+        return self
+
+    def keys_only(self):
+        self.is_keys_only = True
+
+    def matches(self, entity):
+        for name, op, value in self.filters:
+            if name not in entity:
+                return False
+            prop = entity[name]
+            values = prop if isinstance(prop, list) else [prop]
+            if op == "=" and value not in values:
+                return False
+            if op in (">", ">=", "<", "<=") and not any(
+                    {">": v > value, ">=": v >= value, "<": v < value, "<=": v <= value}[op]
+                    for v in values if v is not None):
+                return False
+        return True
+
+    def fetch(self, limit=None, offset=0, start_cursor=None, eventual=False):
+        self.client.rpc()
+        with self.client.lock:
+            results = [copy_entity(e) for e in self.client.store.values()
+                       if e.key.kind == self.kind and self.matches(e)]
+        results.sort(key=lambda e: key_sort_value(e.key))
+        for name in reversed(self.order):
+            reverse = name.startswith("-")
+            name = name.lstrip("-")
+            results.sort(key=lambda e: e.get(name), reverse=reverse)
+        if self.projection:
+            results = [e for e in results if all(p in e for p in self.projection)]
+        if start_cursor:
+            if isinstance(start_cursor, str):
+                start_cursor = start_cursor.encode("utf-8")
+            offset += int(base64.urlsafe_b64decode(start_cursor))
+        end = len(results) if limit is None else offset + limit
+        page = results[offset:end]
+        if self.projection:
+            projected = []
+            for e in page:
+                p = Entity(key=e.key)
+                p.update({name: e[name] for name in self.projection})
+                projected.append(p)
+            page = projected
+        if self.is_keys_only:
+            page = [Entity(key=e.key) for e in page]
+        next_token = base64.urlsafe_b64encode(str(end).encode("utf-8")) if end < len(results) else None
+        return FakeIterator(page, next_token)
+
+
+class FakeDatastoreClient:
+
+    def __init__(self, latency=0.0):
+        self.project = project
+        self.latency = latency
+        self.store = {}
+        self.ids = itertools.count(5000000000000000)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.rpc_count = 0
+
+    def rpc(self):
+        self.rpc_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def current_transaction(self):
+        return getattr(self.local, "transaction", None)
+
+    def key(self, *path, **kwargs):
+        kwargs.setdefault("project", self.project)
+        return Key(*path, **kwargs)
+
+    def query(self, kind=None):
+        return FakeQuery(self, kind)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def allocate_ids(self, incomplete_key, num_ids):
+        self.rpc()
+        return [incomplete_key.completed_key(next(self.ids)) for _ in range(num_ids)]
+
+    def get(self, key, eventual=False):
+        found = self.get_multi([key], eventual=eventual)
+        return found[0] if found else None
+
+    def get_multi(self, keys, missing=None, eventual=False):
+        if len(keys) > max_lookup_keys:
+            raise exceptions.InvalidArgument(f"cannot look up more than {max_lookup_keys} keys")
+        self.rpc()
+        transaction = self.current_transaction
+        found = []
+        with self.lock:
+            for key in keys:
+                if transaction is not None and key in transaction.deletes:
+                    entity = None
+                elif transaction is not None and key in transaction.puts:
+                    entity = transaction.puts[key]
+                else:
+                    entity = self.store.get(key)
+                if entity is not None:
+                    found.append(copy_entity(entity))
+                elif missing is not None:
+                    missing.append(Entity(key=key))
+        return found
+
+    def complete_key(self, entity):
+        if entity.key.is_partial:
+            entity.key = entity.key.completed_key(next(self.ids))
+
+    def put(self, entity):
+        self.put_multi([entity])
+
+    def put_multi(self, entities):
+        for entity in entities:
+            self.complete_key(entity)
+        transaction = self.current_transaction
+        if transaction is not None:
+            for entity in entities:
+                transaction.deletes.discard(entity.key)
+                transaction.puts[entity.key] = copy_entity(entity)
+            return
+        self.commit([copy_entity(e) for e in entities], [])
+
+    def delete(self, key):
+        self.delete_multi([key])
+
+    def delete_multi(self, keys):
+        transaction = self.current_transaction
+        if transaction is not None:
+            for key in keys:
+                transaction.puts.pop(key, None)
+                transaction.deletes.add(key)
+            return
+        self.commit([], list(keys))
+
+    def commit(self, puts, deletes):
+        if len(puts) + len(deletes) > max_commit_mutations:
+            raise exceptions.InvalidArgument(f"cannot commit more than {max_commit_mutations} mutations")
+        self.rpc()
+        with self.lock:
+            for entity in puts:
+                self.store[entity.key] = entity
+            for key in deletes:
+                self.store.pop(key, None)
+
+    def count(self, kind):
+        return sum(1 for key in self.store if key.kind == kind)
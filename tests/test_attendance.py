@@ -0,0 +1,78 @@
+from conftest import json_headers
+from test_smoke import create_band, create_concert
+import attendance
+import concert_lists
+import constants
+import main
+import search
+import upcoming
+
+
+def attend(client, user_id, concert_ids):
+    res = client.post(f"/users/{user_id}/concerts", json={"concerts": concert_ids}, headers=json_headers)
+    assert res.status_code == 201
+
+
+def test_user_upcoming_pages_by_cursor(client, ds, login_as):
+    main.complete_login(main.generate_new_state(), {"f_name": "A", "l_name": "B", "user_id": "9"})
+    login_as("9")
+    band = create_band(client)
+    dates = ["03-01-2031", "01-01-2031", "02-01-2031", "01-01-2001"]
+    concert_ids = [create_concert(client, band["id"], date)["id"] for date in dates]
+    attend(client, "9", concert_ids)
+    res = client.get("/users/9/concerts/upcoming?limit=2", headers=json_headers).get_json()
+    assert [c["date"] for c in res["concerts"]] == ["01-01-2031", "02-01-2031"]
+    res = client.get(res["next"], headers=json_headers).get_json()
+    assert [c["date"] for c in res["concerts"]] == ["03-01-2031"]
+    assert "next" not in res
+
+
+def test_rows_follow_concert_edits_and_deletes(client, ds, login_as):
+    main.complete_login(main.generate_new_state(), {"f_name": "A", "l_name": "B", "user_id": "9"})
+    login_as("9")
+    band = create_band(client)
+    concert = create_concert(client, band["id"])
+    attend(client, "9", [concert["id"]])
+    client.patch(f"/concerts/{concert['id']}", json={"venue": "Arena"}, headers=json_headers)
+    res = client.get("/users/9/concerts/upcoming", headers=json_headers).get_json()
+    assert [c["venue"] for c in res["concerts"]] == ["Arena"]
+    client.delete(f"/concerts/{concert['id']}", headers=json_headers)
+    assert ds.count(constants.attendance) == 0
+
+
+def test_rebuild_user_drops_stale_rows(client, ds, login_as):
+    main.complete_login(main.generate_new_state(), {"f_name": "A", "l_name": "B", "user_id": "9"})
+    login_as("9")
+    band = create_band(client)
+    concert_ids = [create_concert(client, band["id"])["id"] for _ in range(2)]
+    attend(client, "9", concert_ids)
+    concert_lists.remove_concert_ids(ds.get(ds.key(constants.user, "9")), concert_ids[:1])
+    assert attendance.rebuild_user(ds.get(ds.key(constants.user, "9"))) == 1
+    assert ds.get(attendance.row_key("9", concert_ids[0])) is None
+    assert ds.get(attendance.row_key("9", concert_ids[1])) is not None
+
+
+def test_bulk_deletes_are_chunked(ds):
+    upcoming.remove_concerts(range(1, 1201))
+    search.remove_documents(constants.concert, range(1, 601))
+    assert ds.rpc_count == 5
+
+
+def test_stats_follow_band_and_concert_changes(client, ds, login_as):
+    main.complete_login(main.generate_new_state(), {"f_name": "A", "l_name": "B", "user_id": "9"})
+    main.complete_login(main.generate_new_state(), {"f_name": "C", "l_name": "D", "user_id": "10"})
+    login_as("9")
+    band = create_band(client)
+    concert = create_concert(client, band["id"])
+    other = create_concert(client, band["id"], "05-05-2032")
+    attend(client, "9", [concert["id"], other["id"]])
+    client.patch(f"/bands/{band['id']}", json={"genre": "Jazz"}, headers=json_headers)
+    client.patch(f"/concerts/{concert['id']}", json={"date": "01-01-2033"}, headers=json_headers)
+    stats = client.get("/users/9/stats", headers=json_headers).get_json()
+    assert stats["genres"] == {"Jazz": 2}
+    assert stats["years"] == {"2032": 1, "2033": 1}
+    client.delete(f"/concerts/{other['id']}", headers=json_headers)
+    stats = client.get("/users/9/stats", headers=json_headers).get_json()
+    assert stats["concert_count"] == 1
+    user = client.get("/users/9/concerts", headers=json_headers).get_json()
+    assert [c["id"] for c in user["concerts"]] == [concert["id"]]
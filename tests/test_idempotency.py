@@ -0,0 +1,61 @@
+import pytest
+from conftest import json_headers
+import constants
+import search
+
+
+band_body = {"name": "Retry", "genre": "Rock", "members": ["A"]}
+
+
+def post_band(client, key):
+    return client.post("/bands", json=band_body, headers=dict(json_headers, **{"Idempotency-Key": key}))
+
+
+def test_replays_completed_request(client, ds):
+    first = post_band(client, "k1")
+    second = post_band(client, "k1")
+    assert first.status_code == second.status_code == 201
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.get_json()["id"] == first.get_json()["id"]
+    assert ds.count(constants.band) == 1
+
+
+def test_retry_after_committed_write_resumes(client, ds, monkeypatch):
+    index_band = search.index_band
+
+    def fail(band):
+        raise RuntimeError("search unavailable")
+    monkeypatch.setattr(search, "index_band", fail)
+    with pytest.raises(RuntimeError):
+        post_band(client, "k2")
+    assert ds.count(constants.band) == 1
+    monkeypatch.setattr(search, "index_band", index_band)
+    res = post_band(client, "k2")
+    assert res.status_code == 201
+    assert ds.count(constants.band) == 1
+    assert ds.count(constants.search_doc) == 1
+    assert post_band(client, "k2").get_json()["id"] == res.get_json()["id"]
+
+
+def test_retry_after_failed_write_runs_again(client, ds, monkeypatch):
+    commit = ds.commit
+
+    def fail(puts, deletes):
+        if any(entity.key.kind == constants.band for entity in puts):
+            raise RuntimeError("commit failed")
+        commit(puts, deletes)
+    monkeypatch.setattr(ds, "commit", fail)
+    with pytest.raises(RuntimeError):
+        post_band(client, "k3")
+    monkeypatch.setattr(ds, "commit", commit)
+    assert ds.count(constants.band) == 0
+    assert ds.count(constants.idempotency) == 0
+    assert post_band(client, "k3").status_code == 201
+    assert ds.count(constants.band) == 1
+
+
+def test_key_reused_with_different_body(client):
+    assert post_band(client, "k4").status_code == 201
+    res = client.post("/bands", json=dict(band_body, name="Other"),
+                      headers=dict(json_headers, **{"Idempotency-Key": "k4"}))
+    assert res.status_code == 422
@@ -0,0 +1,95 @@
+import gzip
+import brotli
+import pytest
+from conftest import json_headers
+from test_smoke import create_band, create_concert
+import constants
+import main
+
+
+@pytest.fixture
+def small_threshold(monkeypatch):
+    monkeypatch.setattr(constants, "compression_min_size", 10)
+
+
+def get_bands(client, accept_encoding):
+    return client.get("/bands?limit=20", headers=dict(json_headers, **{"Accept-Encoding": accept_encoding}))
+
+
+def test_prefers_brotli(client, small_threshold):
+    create_band(client)
+    res = get_bands(client, "gzip, br")
+    assert res.headers["Content-Encoding"] == "br"
+    assert b"The Testers" in brotli.decompress(res.get_data())
+    assert "Accept-Encoding" in res.headers["Vary"]
+
+
+def test_gzip_when_brotli_refused(client, small_threshold):
+    create_band(client)
+    res = get_bands(client, "br;q=0, gzip;q=0.5")
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert b"The Testers" in gzip.decompress(res.get_data())
+
+
+def test_no_encoding_when_all_refused(client, small_threshold):
+    create_band(client)
+    for accept_encoding in ("br;q=0, gzip;q=0", "identity", ""):
+        res = get_bands(client, accept_encoding)
+        assert "Content-Encoding" not in res.headers
+        assert b"The Testers" in res.get_data()
+
+
+def test_small_bodies_are_not_compressed(client):
+    create_band(client)
+    res = get_bands(client, "gzip")
+    assert len(res.get_data()) < constants.compression_min_size
+    assert "Content-Encoding" not in res.headers
+
+
+def test_large_bodies_are_compressed(client):
+    for i in range(10):
+        create_band(client, f"Band {i}")
+    assert len(get_bands(client, "").get_data()) >= constants.compression_min_size
+    assert get_bands(client, "gzip").headers["Content-Encoding"] == "gzip"
+
+
+def test_event_streams_are_not_compressed(client, small_threshold):
+    res = client.get("/changes/stream", headers={"Accept-Encoding": "gzip, br"})
+    assert res.headers["Content-type"] == "text/event-stream"
+    assert "Content-Encoding" not in res.headers
+    res.close()
+
+
+@pytest.fixture
+def catalog(client, login_as):
+    main.complete_login(main.generate_new_state(), {"f_name": "A", "l_name": "B", "user_id": "9"})
+    login_as("9")
+    band = create_band(client)
+    concert = create_concert(client, band["id"])
+    client.post("/users/9/concerts", json={"concerts": [concert["id"]]}, headers=json_headers)
+    return band, concert
+
+
+@pytest.mark.parametrize("path, extra_headers, policy", [
+    ("/users/9/concerts", {}, "private, no-cache"),
+    ("/users/9/concerts/upcoming", {}, "private, no-cache"),
+    ("/users/9/stats", {}, "private, no-cache"),
+    ("/concerts/upcoming/rebuild", {"X-Appengine-Cron": "true"}, "no-store"),
+    ("/changes", {}, "no-cache"),
+    ("/search?q=testers", {}, "public, max-age=30, s-maxage=60"),
+    ("/bands", {}, "public, max-age=30, s-maxage=60"),
+    ("/concerts", {}, "public, max-age=30, s-maxage=60"),
+    ("/concerts/upcoming", {}, "public, max-age=30, s-maxage=60"),
+])
+def test_cache_control_policies(client, catalog, path, extra_headers, policy):
+    res = client.get(path, headers=dict(json_headers, **extra_headers))
+    assert res.status_code in (200, 204)
+    assert res.headers["Cache-Control"] == policy
+    vary = res.headers.get("Vary", "")
+    assert ("Authorization" in vary) == policy.startswith("private")
+
+
+def test_cache_control_skips_errors_and_writes(client):
+    assert "Cache-Control" not in client.get("/bands/1", headers=json_headers).headers
+    res = client.post("/bands", json={"name": "X", "genre": "Y", "members": []}, headers=json_headers)
+    assert "Cache-Control" not in res.headers
@@ -0,0 +1,60 @@
+import os
+import sys
+import flask
+import pytest
+import profiling
+
+
+admin_headers = {"Authorization": "Bearer secret"}
+
+
+@pytest.fixture
+def profiled_app(monkeypatch):
+    def make(**env):
+        monkeypatch.setenv("PROFILE_SAMPLE_RATE", "1")
+        monkeypatch.setenv("PROFILE_ADMIN_TOKEN", "secret")
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        monkeypatch.setattr(profiling, "active", {"backend": "cprofile"})
+        profiling.aggregates.clear()
+        app = flask.Flask("profiled")
+        app.add_url_rule("/work", "work", lambda: sum(range(1000)) and "done")
+        profiling.init_app(app)
+        return app.test_client()
+    yield make
+    profiling.aggregates.clear()
+
+
+def test_sampled_requests_are_aggregated(profiled_app, tmp_path):
+    client = profiled_app(PROFILE_OUTPUT_DIR=str(tmp_path))
+    for _ in range(3):
+        assert client.get("/work").status_code == 200
+    res = client.get("/admin/profiles?endpoint=work&limit=5", headers=admin_headers)
+    assert res.status_code == 200
+    body = res.get_json()
+    assert body["backend"] == "cprofile"
+    assert body["profiles"]["work"]["samples"] == 3
+    assert 0 < len(body["profiles"]["work"]["functions"]) <= 5
+    assert len([f for f in os.listdir(tmp_path) if f.startswith("work-")]) == 3
+    assert client.delete("/admin/profiles", headers=admin_headers).status_code == 204
+    assert "work" not in client.get("/admin/profiles", headers=admin_headers).get_json()["profiles"]
+
+
+def test_admin_endpoint_requires_token(profiled_app):
+    client = profiled_app()
+    assert client.get("/admin/profiles").status_code == 401
+    assert client.get("/admin/profiles", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+
+def test_unwritable_output_dir_does_not_fail_requests(profiled_app, tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    client = profiled_app(PROFILE_OUTPUT_DIR=str(blocker / "profiles"))
+    assert client.get("/work").status_code == 200
+
+
+def test_missing_pyinstrument_falls_back_to_cprofile(profiled_app, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyinstrument", None)
+    client = profiled_app(PROFILE_BACKEND="pyinstrument")
+    assert client.get("/work").status_code == 200
+    assert client.get("/admin/profiles", headers=admin_headers).get_json()["backend"] == "cprofile"
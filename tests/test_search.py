@@ -0,0 +1,47 @@
+from conftest import json_headers
+
+
+def create_band(client, name):
+    res = client.post("/bands", json={"name": name, "genre": "Pop", "members": ["A"]}, headers=json_headers)
+    assert res.status_code == 201
+
+
+def search(client, url):
+    res = client.get(url, headers=json_headers)
+    assert res.status_code == 200
+    return res.get_json()
+
+
+def test_search_ranks_results(client):
+    create_band(client, "Rocket Science")
+    create_band(client, "Rock Lobsters")
+    res = search(client, "/search?q=rock&type=band")
+    assert [r["title"] for r in res["results"]] == ["Rock Lobsters", "Rocket Science"]
+    assert "next" not in res
+
+
+def test_exact_matches_come_before_prefix_matches(client):
+    for i in range(6):
+        create_band(client, f"Rockers {i}")
+    create_band(client, "Rock")
+    res = search(client, "/search?q=rock&limit=1")
+    assert [r["title"] for r in res["results"]] == ["Rock"]
+    assert "next" in res
+
+
+def test_search_pages_through_all_matches(client):
+    names = [f"Rockers {i}" for i in range(7)] + ["Rock"]
+    for name in names:
+        create_band(client, name)
+    seen = []
+    url = "/search?q=rock&type=band&limit=3"
+    while url:
+        res = search(client, url)
+        seen.extend(r["title"] for r in res["results"])
+        url = res.get("next")
+    assert seen[0] == "Rock"
+    assert sorted(seen) == sorted(names)
+
+
+def test_search_rejects_bad_cursor(client):
+    assert client.get("/search?q=rock&cursor=bogus", headers=json_headers).status_code == 400
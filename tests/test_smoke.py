@@ -0,0 +1,188 @@
+import types
+from google.api_core import exceptions
+from conftest import json_headers
+import changes
+import clients
+import constants
+import main
+
+
+def create_band(client, name="The Testers"):
+    res = client.post("/bands", json={"name": name, "genre": "Rock", "members": ["A", "B"]},
+                      headers=json_headers)
+    assert res.status_code == 201
+    return res.get_json()
+
+
+def create_concert(client, band_id, date="10-20-2030"):
+    res = client.post("/concerts", json={"venue": "Hall", "address": "1 Main St", "date": date,
+                                         "band": band_id}, headers=json_headers)
+    assert res.status_code == 201
+    return res.get_json()
+
+
+def test_band_crud(client):
+    band = create_band(client)
+    res = client.get(f"/bands/{band['id']}", headers=json_headers)
+    assert res.status_code == 200
+    assert res.get_json()["name"] == "The Testers"
+    res = client.patch(f"/bands/{band['id']}", json={"genre": "Jazz"}, headers=json_headers)
+    assert res.status_code == 200
+    assert res.get_json()["genre"] == "Jazz"
+    assert client.get("/bands", headers=json_headers).get_json()["collection_length"] == 1
+    assert client.delete(f"/bands/{band['id']}", headers=json_headers).status_code == 204
+    assert client.get(f"/bands/{band['id']}", headers=json_headers).status_code == 404
+
+
+def test_concert_lifecycle(client):
+    band = create_band(client)
+    concert = create_concert(client, band["id"])
+    assert concert["date"] == "10-20-2030"
+    band_res = client.get(f"/bands/{band['id']}", headers=json_headers).get_json()
+    assert [c["id"] for c in band_res["concerts"]] == [concert["id"]]
+    upcoming = client.get("/concerts/upcoming", headers=json_headers).get_json()
+    assert [c["id"] for c in upcoming["concerts"]] == [concert["id"]]
+    assert client.delete(f"/concerts/{concert['id']}", headers=json_headers).status_code == 204
+    band_res = client.get(f"/bands/{band['id']}", headers=json_headers).get_json()
+    assert band_res["concerts"] == []
+
+
+def test_user_concerts_and_stats(client, login_as):
+    main.complete_login(main.generate_new_state(), {"f_name": "A", "l_name": "B", "user_id": "42"})
+    login_as("42")
+    band = create_band(client)
+    concert = create_concert(client, band["id"])
+    res = client.post("/users/42/concerts", json={"concerts": [concert["id"]]}, headers=json_headers)
+    assert res.status_code == 201
+    stats = client.get("/users/42/stats", headers=json_headers).get_json()
+    assert stats["concert_count"] == 1
+    assert stats["genres"] == {"Rock": 1}
+    upcoming = client.get("/users/42/concerts/upcoming", headers=json_headers).get_json()
+    assert [c["id"] for c in upcoming["concerts"]] == [concert["id"]]
+    assert client.delete(f"/users/42/concerts/{concert['id']}", headers=json_headers).status_code == 204
+    assert client.get("/users/42/concerts", headers=json_headers).get_json()["concerts"] == []
+
+
+def test_login_is_get_or_insert(ds):
+    user_info = {"f_name": "A", "l_name": "B", "user_id": "7"}
+    state = main.generate_new_state()
+    assert main.validate_state(state)
+    assert main.complete_login(state, user_info)
+    assert not main.complete_login(state, user_info)
+    assert main.complete_login(main.generate_new_state(), user_info)
+    assert ds.count("user") == 1
+
+
+def test_changes_are_committed_with_writes(client, ds, login_as, monkeypatch):
+    monkeypatch.setattr(constants, "changes_settle_seconds", -1)
+    monkeypatch.setattr(changes, "latest_seq_cache", {"seq": 0, "checked_at": -constants.changes_poll_seconds})
+    main.complete_login(main.generate_new_state(), {"f_name": "A", "l_name": "B", "user_id": "7"})
+    login_as("7")
+    band = create_band(client)
+    concert = create_concert(client, band["id"])
+    client.post("/users/7/concerts", json={"concerts": [concert["id"]]}, headers=json_headers)
+    assert client.delete(f"/bands/{band['id']}", headers=json_headers).status_code == 204
+    feed = client.get("/changes", headers=json_headers).get_json()
+    ops = [(c["kind"], c["op"]) for c in feed["changes"]]
+    assert ops == [(constants.band, "create"), (constants.concert, "create"),
+                   (constants.user, "add_concerts"), (constants.concert, "delete"),
+                   (constants.band, "delete")]
+    assert feed["last_seq"] == max(c["seq"] for c in feed["changes"])
+    login_as("8")
+    feed = client.get("/changes", headers=json_headers).get_json()
+    assert constants.user not in [c["kind"] for c in feed["changes"]]
+
+
+def test_change_sequence_numbers_are_redrawn_on_collision(ds, monkeypatch):
+    draws = iter([5, 5, 5, 6, 5, 7])
+    monkeypatch.setattr(changes, "time", types.SimpleNamespace(time=lambda: 1000.0))
+    monkeypatch.setattr(changes, "random", types.SimpleNamespace(randrange=lambda n: next(draws)))
+    clients.commit(puts=[changes.new_change(constants.band, 1, "create")])
+    clients.commit(puts=[changes.new_change(constants.band, 2, "create"),
+                         changes.new_change(constants.band, 3, "create")])
+    base = changes.seq_at(1000.0)
+    seqs = {ds.get(ds.key(constants.change, base + n))["id"]: n for n in (5, 6, 7)}
+    assert seqs == {"1": 5, "2": 7, "3": 6}
+
+
+def test_change_sequence_numbers_are_drawn_per_attempt(ds, monkeypatch):
+    clock = iter([1000.0, 1001.0])
+    monkeypatch.setattr(changes, "time", types.SimpleNamespace(time=lambda: next(clock)))
+    monkeypatch.setattr(changes, "random", types.SimpleNamespace(randrange=lambda n: 0))
+    monkeypatch.setattr(constants, "transaction_backoff_seconds", 0)
+    commit = ds.commit
+    conflicts = []
+
+    def conflicting_commit(puts, deletes):
+        if not conflicts:
+            conflicts.append(1)
+            raise exceptions.Conflict("contention")
+        commit(puts, deletes)
+    monkeypatch.setattr(ds, "commit", conflicting_commit)
+    clients.commit(puts=[changes.new_change(constants.band, 1, "create")])
+    assert ds.get(ds.key(constants.change, changes.seq_at(1000.0))) is None
+    assert ds.get(ds.key(constants.change, changes.seq_at(1001.0)))["seq"] == changes.seq_at(1001.0)
+
+
+def test_concert_date_keeps_given_calendar_date(client):
+    band = create_band(client)
+    concert = create_concert(client, band["id"], date="2030-10-20T20:30:00-07:00")
+    assert concert["date"] == "10-20-2030"
+    assert concert["timestamp"] == "2030-10-21T03:30:00+00:00"
+    upcoming = client.get("/concerts/upcoming", headers=json_headers).get_json()
+    assert [c["date"] for c in upcoming["concerts"]] == ["10-20-2030"]
+
+
+def test_concert_date_out_of_range(client):
+    band = create_band(client)
+    for date in ("9999-12-31T23:00:00-05:00", "0001-01-01T00:30:00+01:00"):
+        res = client.post("/concerts", json={"venue": "Hall", "address": "1 Main St", "date": date,
+                                             "band": band["id"]}, headers=json_headers)
+        assert res.status_code == 400
+
+
+def test_login_retries_aborted_transaction(ds, monkeypatch):
+    from google.api_core import exceptions
+    commit = ds.commit
+    attempts = []
+
+    def flaky_commit(puts, deletes):
+        attempts.append(1)
+        if len(attempts) == 2:  # first commit stores the state, second is the login
+            raise exceptions.Aborted("too much contention")
+        commit(puts, deletes)
+    monkeypatch.setattr(ds, "commit", flaky_commit)
+    monkeypatch.setattr(constants, "transaction_backoff_seconds", 0)
+    state = main.generate_new_state()
+    assert main.complete_login(state, {"f_name": "A", "l_name": "B", "user_id": "5"})
+    assert ds.get(ds.key(constants.user, "5")) is not None
+    assert not main.complete_login(state, {"f_name": "A", "l_name": "B", "user_id": "5"})
+
+
+def test_change_streams_are_capped(client, monkeypatch):
+    import threading
+    monkeypatch.setattr(changes, "stream_slots", threading.BoundedSemaphore(1))
+    first = client.get("/changes/stream")
+    assert first.status_code == 200
+    second = client.get("/changes/stream")
+    assert second.status_code == 503
+    assert second.headers["Retry-After"] == str(constants.changes_stream_seconds)
+    first.close()
+    third = client.get("/changes/stream")
+    assert third.status_code == 200
+    third.close()
+
+
+def test_concert_date_range_bounds(client):
+    band = create_band(client)
+    for date in ("2030-11-30T23:00:00", "12-01-2030", "2030-12-31T22:00:00", "01-01-2031"):
+        create_concert(client, band["id"], date)
+
+    def dates(args):
+        res = client.get(f"/concerts?{args}&limit=10", headers=json_headers).get_json()
+        return [c["date"] for c in res["concerts"]], res["collection_length"]
+    assert dates("from=12-01-2030&to=12-31-2030") == (["12-01-2030", "12-31-2030"], 2)
+    assert dates("from=2030-12-01&to=2030-12-31") == (["12-01-2030", "12-31-2030"], 2)
+    assert dates("to=2030-12-31T22:00:00") == (["11-30-2030", "12-01-2030", "12-31-2030"], 3)
+    assert dates("to=2030-12-31T21:59:59") == (["11-30-2030", "12-01-2030"], 2)
+    assert dates("from=01-01-2031&to=12-31-9999") == (["01-01-2031"], 1)
@@ -0,0 +1,20 @@
+import constants
+import snapshots
+
+
+def test_snapshots_are_bounded(ds, monkeypatch):
+    monkeypatch.setattr(constants, "snapshot_max_entries", 3)
+    for offset in range(10):
+        snapshots.read("bands.list", constants.band, (offset,), lambda: offset)
+    assert len(snapshots.snapshots) == 3
+    assert snapshots.read("bands.list", constants.band, (9,), lambda: None) == 9
+    snapshots.read("bands.list", constants.band, (10,), lambda: 10)
+    assert (constants.band, "bands.list", 9) in snapshots.snapshots
+    assert (constants.band, "bands.list", 7) not in snapshots.snapshots
+
+
+def test_stale_snapshots_are_evicted(ds, monkeypatch):
+    snapshots.read("bands.list", constants.band, (0,), lambda: 0)
+    monkeypatch.setattr(constants, "snapshot_max_stale_seconds", 0)
+    snapshots.read("bands.list", constants.band, (1,), lambda: 1)
+    assert list(snapshots.snapshots) == []
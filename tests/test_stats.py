@@ -0,0 +1,59 @@
+from google.api_core import exceptions
+from conftest import json_headers
+from test_smoke import create_band, create_concert
+import concert_lists
+import constants
+import main
+import stats
+
+
+def setup_user(client, login_as, concert_count=2):
+    main.complete_login(main.generate_new_state(), {"f_name": "A", "l_name": "B", "user_id": "9"})
+    login_as("9")
+    band = create_band(client)
+    concert_ids = [create_concert(client, band["id"])["id"] for _ in range(concert_count)]
+    res = client.post("/users/9/concerts", json={"concerts": concert_ids}, headers=json_headers)
+    assert res.status_code == 201
+    return band, concert_ids
+
+
+def stats_for(client):
+    return client.get("/users/9/stats", headers=json_headers).get_json()
+
+
+def test_update_retries_conflicts(client, ds, login_as, monkeypatch):
+    band, concert_ids = setup_user(client, login_as)
+    commit = ds.commit
+    conflicts = []
+
+    def conflicting_commit(puts, deletes):
+        if not conflicts and any(e.key.kind == constants.user_stats for e in puts):
+            conflicts.append(1)
+            raise exceptions.Conflict("contention")
+        commit(puts, deletes)
+    monkeypatch.setattr(ds, "commit", conflicting_commit)
+    monkeypatch.setattr(constants, "transaction_backoff_seconds", 0)
+    assert client.delete(f"/users/9/concerts/{concert_ids[0]}", headers=json_headers).status_code == 204
+    assert conflicts
+    assert stats_for(client)["concert_count"] == 1
+
+
+def test_update_after_reset_rebuilds(client, ds, login_as):
+    band, concert_ids = setup_user(client, login_as)
+    stats.reset("9")
+    assert client.delete(f"/users/9/concerts/{concert_ids[0]}", headers=json_headers).status_code == 204
+    assert stats_for(client)["concert_count"] == 1
+
+
+def test_stale_attendance_row_does_not_decrement(client, ds, login_as):
+    band, concert_ids = setup_user(client, login_as)
+    user = ds.get(ds.key(constants.user, "9"))
+    stats.remove_concerts(user, concert_lists.remove_concert_ids(user, concert_ids[:1]))
+    assert client.delete(f"/concerts/{concert_ids[0]}", headers=json_headers).status_code == 204
+    assert stats_for(client)["concert_count"] == 1
+
+
+def test_genre_change_moves_counts(client, ds, login_as):
+    band, concert_ids = setup_user(client, login_as)
+    client.patch(f"/bands/{band['id']}", json={"genre": "Jazz"}, headers=json_headers)
+    assert stats_for(client)["genres"] == {"Jazz": 2}
@@ -0,0 +1,53 @@
+import json
+from conftest import json_headers
+from test_smoke import create_band, create_concert
+import constants
+import main
+
+
+def create_users(client, login_as, count=3):
+    for n in range(count):
+        main.complete_login(main.generate_new_state(), {"f_name": f"F{n}", "l_name": f"L{n}", "user_id": str(n)})
+    login_as("0")
+    band = create_band(client)
+    concert = create_concert(client, band["id"])
+    res = client.post("/users/0/concerts", json={"concerts": [concert["id"]]}, headers=json_headers)
+    assert res.status_code == 201
+
+
+def test_list_returns_projected_users_only(client, login_as):
+    create_users(client, login_as)
+    users = client.get("/users?limit=10", headers=json_headers).get_json()["users"]
+    assert sorted(users, key=lambda u: u["user_id"]) == [
+        {"f_name": f"F{n}", "l_name": f"L{n}", "user_id": str(n)} for n in range(3)]
+
+
+def test_list_pages_with_cursors(client, login_as):
+    create_users(client, login_as)
+    first = client.get("/users?limit=2", headers=json_headers).get_json()
+    assert len(first["users"]) == 2
+    assert first["self"] == "http://localhost/users?limit=2"
+    assert first["next"].startswith("http://localhost/users?limit=2&cursor=")
+    second = client.get(first["next"], headers=json_headers).get_json()
+    assert len(second["users"]) == 1
+    assert "next" not in second
+    ids = [u["user_id"] for u in first["users"] + second["users"]]
+    assert sorted(ids) == ["0", "1", "2"]
+
+
+def test_list_limit_is_capped(client, login_as, monkeypatch):
+    create_users(client, login_as)
+    monkeypatch.setattr(constants, "users_pg_limit", 2)
+    res = client.get("/users?limit=1000", headers=json_headers).get_json()
+    assert len(res["users"]) == 2
+    assert res["self"] == "http://localhost/users?limit=2"
+
+
+def test_list_streams_all_users(client, login_as):
+    create_users(client, login_as)
+    res = client.get("/users?stream=true", headers=json_headers)
+    assert res.status_code == 200
+    assert res.is_streamed
+    users = json.loads(res.get_data(as_text=True))
+    assert sorted(u["user_id"] for u in users) == ["0", "1", "2"]
+    assert all(set(u) == {"f_name", "l_name", "user_id"} for u in users)
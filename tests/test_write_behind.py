@@ -0,0 +1,62 @@
+import pytest
+from google.api_core import exceptions
+import clients
+import constants
+import main
+import write_behind
+
+
+@pytest.fixture
+def buffer(ds, monkeypatch):
+    # Fresh pending buffer with a placeholder flusher so no background thread starts
+    monkeypatch.setattr(write_behind, "pending", {})
+    monkeypatch.setattr(write_behind, "flusher", {"thread": "test"})
+    return write_behind.pending
+
+
+def put_user(ds, user_id, **properties):
+    user = clients.new_entity(key=ds.key(constants.user, user_id))
+    user.update({"user_id": user_id, "f_name": "A", "l_name": "B", **properties})
+    ds.put(user)
+    return user.key
+
+
+def test_later_updates_overwrite_pending_values(ds, buffer):
+    key = put_user(ds, "1")
+    write_behind.enqueue(key, {"f_name": "C", "l_name": "D"})
+    write_behind.enqueue(key, {"f_name": "E"})
+    assert buffer == {key: {"f_name": "E", "l_name": "D"}}
+    assert write_behind.flush() == 1
+    assert buffer == {}
+    user = ds.get(key)
+    assert (user["f_name"], user["l_name"], user["user_id"]) == ("E", "D", "1")
+
+
+def test_failed_flush_requeues_without_overwriting_newer_values(ds, buffer, monkeypatch):
+    key = put_user(ds, "1")
+    other_key = put_user(ds, "2")
+    write_behind.enqueue(key, {"f_name": "C", "l_name": "D"})
+    write_behind.enqueue(other_key, {"f_name": "X"})
+
+    def failing_commit(puts, deletes):
+        # A newer update arrives while the failed flush is in flight
+        write_behind.enqueue(key, {"f_name": "E"})
+        raise exceptions.ServiceUnavailable("unavailable")
+    monkeypatch.setattr(ds, "commit", failing_commit)
+    assert write_behind.flush() is None
+    assert buffer == {key: {"f_name": "E", "l_name": "D"}, other_key: {"f_name": "X"}}
+    assert ds.get(key)["f_name"] == "A"
+
+
+def test_login_buffers_renames_when_write_behind_is_enabled(ds, buffer, monkeypatch):
+    monkeypatch.setattr(constants, "login_write_behind", True)
+    user_info = {"f_name": "A", "l_name": "B", "user_id": "7"}
+    assert main.complete_login(main.generate_new_state(), user_info)
+    assert buffer == {}
+    renamed = dict(user_info, f_name="C")
+    assert main.complete_login(main.generate_new_state(), renamed)
+    key = ds.key(constants.user, "7")
+    assert ds.get(key)["f_name"] == "A"
+    assert buffer == {key: {"f_name": "C", "l_name": "B"}}
+    write_behind.flush()
+    assert ds.get(key)["f_name"] == "C"
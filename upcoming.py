@@ -0,0 +1,88 @@
+import datetime
+import clients
+import constants
+
+
+ds_client = clients.ds_client
+
+
+def concert_sort_date(concert):
+    # Sortable YYYY-MM-DD string from the MM-DD-YYYY calendar date as given
+    month, day, year = concert["date"].split("-")
+    return f"{int(year):04d}-{int(month):02d}-{int(day):02d}"
+
+
+def today():
+    return datetime.datetime.utcnow().date().isoformat()
+
+
+def build_view_entry(concert):
+    entry = clients.new_entity(
+        key=ds_client.key(constants.upcoming, concert.key.id),
+        exclude_from_indexes=("venue", "address", "date")
+    )
+    entry.update({
+        "sort_date": concert_sort_date(concert),
+        "band_id": int(concert["band"]["id"]),
+        "venue": concert["venue"],
+        "address": concert["address"],
+        "date": concert["date"]
+    })
+    return entry
+
+
+def upsert_concert(concert):
+    entry = build_view_entry(concert)
+    if entry["sort_date"] < today():
+        ds_client.delete(entry.key)
+    else:
+        ds_client.put(entry)
+
+
+def remove_concerts(concert_ids):
+    keys = [ds_client.key(constants.upcoming, int(concert_id)) for concert_id in concert_ids]
+    clients.delete_multi(keys)
+
+
+def rebuild():
+    # Recompute every upcoming entry from the concerts and drop stale ones
+    current_date = today()
+    entries = []
+    for concert in ds_client.query(kind=constants.concert).fetch():
+        entry = build_view_entry(concert)
+        if entry["sort_date"] >= current_date:
+            entries.append(entry)
+    live_keys = set(entry.key.id for entry in entries)
+    key_query = ds_client.query(kind=constants.upcoming)
+    key_query.keys_only()
+    stale_keys = [e.key for e in key_query.fetch() if e.key.id not in live_keys]
+    clients.delete_multi(stale_keys)
+    clients.put_multi(entries)
+    return len(entries)
+
+
+def fetch_page(limit, cursor=None, band_id=None):
+    query = ds_client.query(kind=constants.upcoming)
+    query.add_filter("sort_date", ">=", today())
+    if band_id is not None:
+        query.add_filter("band_id", "=", int(band_id))
+    query.order = ["sort_date"]
+    q_result = query.fetch(limit=limit, start_cursor=cursor)
+    entries = list(next(q_result.pages))
+    return entries, q_result.next_page_token
+
+
+def format_entry(entry, host_url, concert_id=None):
+    if concert_id is None:
+        concert_id = entry.key.id
+    return {
+        "id": concert_id,
+        "venue": entry["venue"],
+        "address": entry["address"],
+        "date": entry["date"],
+        "band": {
+            "id": entry["band_id"],
+            "self": host_url + "bands/" + str(entry["band_id"])
+        },
+        "self": host_url + "concerts/" + str(concert_id)
+    }
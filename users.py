@@ -1,18 +1,18 @@
-from flask import Blueprint, request, make_response
-from google.auth.transport import requests as grequests
-from google.cloud import datastore
-from google.oauth2 import id_token
+from flask import Blueprint, request, make_response, Response, stream_with_context
 import json
+import attendance
+import changes
+import clients
+import concert_lists
 import constants
+import idempotency
+import stats
 
 
-ds_client = datastore.Client()
+ds_client = clients.ds_client
 bp = Blueprint('users', __name__, url_prefix='/users')
-
-with open('client_secret.json', 'r') as client_secret_json:
-    data = client_secret_json.read()
-client_properties = json.loads(data)
-client_id = client_properties['web']['client_id']
+pg_limit = 5
+user_projection = ["f_name", "l_name", "user_id"]
 
 
 #######################################################################
@@ -53,6 +53,17 @@ def validate_content_header_json(req_headers):
     return None
 
 
+def find_user(user_id):
+    # Users are keyed by user_id; older users with generated ids are found by property
+    user = ds_client.get(ds_client.key(constants.user, user_id))
+    if user is not None:
+        return user
+    query = ds_client.query(kind=constants.user)
+    query.add_filter("user_id", "=", user_id)
+    user_list = list(query.fetch(limit=1))
+    return user_list[0] if user_list else None
+
+
 def validate_user_id(user):
     err = {"Error": "No user with this user_id exists"}
     if user is None:
@@ -82,8 +93,10 @@ def get_id_from_jwt(req):
     if len(auth_header) < 2 or auth_header[0] != 'Bearer':
         return None
     jwt_token = auth_header[1]
+    from google.oauth2 import id_token
     try:
-        id_info = id_token.verify_oauth2_token(jwt_token, grequests.Request(), client_id)
+        id_info = id_token.verify_oauth2_token(
+            jwt_token, clients.get_auth_request(), clients.get_client_id())
         user_id = id_info['sub']
     except:
         return None
@@ -122,13 +135,7 @@ def add_concert_to_user(user_id, req):
     content_err = validate_content_header_json(req.headers)
     if content_err is not None:
         return content_err
-    query = ds_client.query(kind=constants.user)
-    user_list = list(query.fetch())
-    user = None
-    for user_entity in user_list:
-        if user_entity["user_id"] == user_id:
-            user = user_entity
-            break
+    user = find_user(user_id)
     user_id_err = validate_user_id(user)
     if user_id_err is not None:
         return user_id_err
@@ -143,18 +150,34 @@ def add_concert_to_user(user_id, req):
     if concert_id_err is not None:
         return concert_id_err
     # Insert concert_id(s) into user concerts and return result
-    current_user_concerts = []
-    for concert in user["concerts"]:
-        current_user_concerts.append(concert["id"])
-    for concert_id in req_body["concerts"]:
-        if concert_id not in current_user_concerts:
-            user["concerts"].append({"id": int(concert_id)})
-    ds_client.put(user)
+    added_concerts = concert_lists.add_concert_ids(
+        user, req_body["concerts"],
+        lambda added: [
+            changes.new_change(constants.user, user_id, "add_concerts", {"concerts": added}, user_id)
+        ] + idempotency.committed(added)
+    )
+    attendance.add(user, added_concerts)
+    stats.add_concerts(user, added_concerts)
+    return user_concerts_response(user, req)
+
+
+def resume_add_concerts(user_id, added_concerts, req):
+    # Finish an add whose concert list write was committed by an earlier attempt.
+    # The earlier attempt may or may not have updated stats, so rebuild them
+    user = find_user(user_id)
+    user_id_err = validate_user_id(user)
+    if user_id_err is not None:
+        return user_id_err
+    attendance.add(user, added_concerts)
+    stats.reset(user["user_id"])
+    return user_concerts_response(user, req)
+
+
+def user_concerts_response(user, req):
     user.pop("f_name", None)
     user.pop("l_name", None)
     user.pop("user_id", None)
-    for concert in user["concerts"]:
-        concert["self"] = req.base_url[:-36] + "concerts/" + str(concert["id"])
+    concert_lists.expand_concerts(user, req.host_url)
     res = make_response(json.dumps(user))
     res.headers.set("Content-type", "application/json")
     res.status_code = 201
@@ -166,13 +189,7 @@ def get_user_concerts(user_id, req):
     accept_err = validate_accept_header_json(req.headers)
     if accept_err is not None:
         return accept_err
-    query = ds_client.query(kind=constants.user)
-    user_list = list(query.fetch())
-    user = None
-    for user_entity in user_list:
-        if user_entity["user_id"] == user_id:
-            user = user_entity
-            break
+    user = find_user(user_id)
     user_id_err = validate_user_id(user)
     if user_id_err is not None:
         return user_id_err
@@ -183,8 +200,7 @@ def get_user_concerts(user_id, req):
     user.pop("f_name", None)
     user.pop("l_name", None)
     user.pop("user_id", None)
-    for concert in user["concerts"]:
-        concert["self"] = req.base_url[:-36] + "concerts/" + str(concert["id"])
+    concert_lists.expand_concerts(user, req.host_url)
     res = make_response(json.dumps(user))
     res.headers.set("Content-type", "application/json")
     res.status_code = 200
@@ -196,13 +212,7 @@ def remove_concert_from_user(user_id, concert_id, req):
     accept_err = validate_accept_header_json(req.headers)
     if accept_err is not None:
         return accept_err
-    query = ds_client.query(kind=constants.user)
-    user_list = list(query.fetch())
-    user = None
-    for user_entity in user_list:
-        if user_entity["user_id"] == user_id:
-            user = user_entity
-            break
+    user = find_user(user_id)
     user_id_err = validate_user_id(user)
     if user_id_err is not None:
         return user_id_err
@@ -213,23 +223,109 @@ def remove_concert_from_user(user_id, concert_id, req):
     if concert_id_err is not None:
         return concert_id_err
     # Remove concert_id from list of user concerts if present
-    for concert in user["concerts"]:
-        if concert["id"] == int(concert_id):
-            user["concerts"].remove(concert)
-            ds_client.put(user)
+    removed_concerts = concert_lists.remove_concert_ids(
+        user, [concert_id],
+        lambda removed: [changes.new_change(constants.user, user_id, "remove_concerts", {"concerts": removed}, user_id)]
+    )
+    attendance.remove(user, removed_concerts)
+    stats.remove_concerts(user, removed_concerts)
     return ('', 204)
 
 
+def get_user_stats_summary(user_id, req):
+    # Validate request headers and user_id
+    accept_err = validate_accept_header_json(req.headers)
+    if accept_err is not None:
+        return accept_err
+    user = find_user(user_id)
+    user_id_err = validate_user_id(user)
+    if user_id_err is not None:
+        return user_id_err
+    auth_err = validate_user_permission(user_id, req)
+    if auth_err is not None:
+        return auth_err
+    # Retrieve and return the user's attendance aggregates
+    user_stats = stats.get_stats(user)
+    res = make_response(json.dumps(stats.format_stats(user_stats, req.host_url, req.base_url)))
+    res.headers.set("Content-type", "application/json")
+    res.status_code = 200
+    return res
+
+
+def user_projection_query():
+    query = ds_client.query(kind=constants.user)
+    query.projection = user_projection
+    return query
+
+
+def stream_all_users():
+    # Yield a JSON array of all users one projection page at a time
+    yield "["
+    first = True
+    cursor = None
+    while True:
+        q_result = user_projection_query().fetch(limit=pg_limit * 20, start_cursor=cursor)
+        for user in next(q_result.pages):
+            if not first:
+                yield ","
+            first = False
+            yield json.dumps(dict(user))
+        cursor = q_result.next_page_token
+        if not cursor:
+            break
+    yield "]"
+
+
+def get_user_upcoming(user_id, req):
+    # Validate request headers and user_id
+    accept_err = validate_accept_header_json(req.headers)
+    if accept_err is not None:
+        return accept_err
+    user = find_user(user_id)
+    user_id_err = validate_user_id(user)
+    if user_id_err is not None:
+        return user_id_err
+    auth_err = validate_user_permission(user_id, req)
+    if auth_err is not None:
+        return auth_err
+    # Retrieve and return one page of the user's upcoming concerts in date order
+    q_limit = int(req.args.get("limit", str(pg_limit)))
+    q_cursor = req.args.get("cursor")
+    rows, next_cursor = attendance.fetch_upcoming(user["user_id"], q_limit, q_cursor)
+    concert_list = {"concerts": [attendance.format_row(row, req.host_url) for row in rows]}
+    concert_list["self"] = f"{req.base_url}?limit={q_limit}"
+    if q_cursor:
+        concert_list["self"] += f"&cursor={q_cursor}"
+    if next_cursor:
+        concert_list["next"] = f"{req.base_url}?limit={q_limit}&cursor={next_cursor.decode('utf-8')}"
+    res = make_response(json.dumps(concert_list))
+    res.headers.set("Content-type", "application/json")
+    res.status_code = 200
+    return res
+
+
 def get_all_users(req):
     # Validate request headers
     accept_err = validate_accept_header_json(req.headers)
     if accept_err is not None:
         return accept_err
-    # Retrieve and return list of all users (omit concerts attribute)
-    query = ds_client.query(kind=constants.user)
-    user_list = list(query.fetch())
-    for user in user_list:
-        user.pop("concerts", None)
+    # Stream all users when requested (attendance lists never leave datastore)
+    if req.args.get("stream", "false").lower() == "true":
+        res = Response(stream_with_context(stream_all_users()))
+        res.headers.set("Content-type", "application/json")
+        res.status_code = 200
+        return res
+    # Retrieve and return one page of users using a projection query
+    q_limit = min(int(req.args.get("limit", str(pg_limit))), constants.users_pg_limit)
+    q_cursor = req.args.get("cursor")
+    q_result = user_projection_query().fetch(limit=q_limit, start_cursor=q_cursor)
+    user_list = {"users": [dict(user) for user in next(q_result.pages)]}
+    user_list["self"] = f"{req.base_url}?limit={q_limit}"
+    if q_cursor:
+        user_list["self"] += f"&cursor={q_cursor}"
+    if q_result.next_page_token:
+        next_cursor = q_result.next_page_token.decode("utf-8")
+        user_list["next"] = f"{req.base_url}?limit={q_limit}&cursor={next_cursor}"
     res = make_response(json.dumps(user_list))
     res.headers.set("Content-type", "application/json")
     res.status_code = 200
@@ -251,7 +347,9 @@ def get_users():
 @bp.route('/<user_id>/concerts', methods=['POST', 'GET'])
 def post_get_user_concerts(user_id):
     if request.method == 'POST':
-        return add_concert_to_user(user_id, request)
+        return idempotency.handle(
+            request, lambda: add_concert_to_user(user_id, request),
+            lambda added: resume_add_concerts(user_id, added, request))
     elif request.method == 'GET':
         return get_user_concerts(user_id, request)
     else:
@@ -259,6 +357,24 @@ def post_get_user_concerts(user_id):
         return invalid_method_response(allowed_methods)
 
 
+@bp.route('/<user_id>/concerts/upcoming', methods=['GET'])
+def get_user_upcoming_concerts(user_id):
+    if request.method == 'GET':
+        return get_user_upcoming(user_id, request)
+    else:
+        allowed_methods = 'GET'
+        return invalid_method_response(allowed_methods)
+
+
+@bp.route('/<user_id>/stats', methods=['GET'])
+def get_user_stats(user_id):
+    if request.method == 'GET':
+        return get_user_stats_summary(user_id, request)
+    else:
+        allowed_methods = 'GET'
+        return invalid_method_response(allowed_methods)
+
+
 @bp.route('/<user_id>/concerts/<concert_id>', methods=['DELETE'])
 def delete_user_concert(user_id, concert_id):
     if request.method == 'DELETE':
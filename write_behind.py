@@ -0,0 +1,62 @@
+import atexit
+import logging
+import threading
+import time
+import clients
+import constants
+
+
+# Coalesces property updates per entity key and writes them periodically with
+# put_multi. Later updates to the same key overwrite earlier pending values.
+ds_client = clients.ds_client
+pending = {}
+lock = threading.Lock()
+flusher = {"thread": None}
+
+
+def enqueue(key, updates):
+    with lock:
+        pending.setdefault(key, {}).update(updates)
+        if flusher["thread"] is None:
+            flusher["thread"] = threading.Thread(target=run_flusher, daemon=True)
+            flusher["thread"].start()
+
+
+def requeue(batch):
+    # Put back updates from a failed flush unless newer ones arrived meanwhile
+    with lock:
+        for key, updates in batch.items():
+            merged = dict(updates)
+            merged.update(pending.get(key, {}))
+            pending[key] = merged
+
+
+def flush():
+    with lock:
+        batch = dict(pending)
+        pending.clear()
+    keys = list(batch)
+    size = constants.login_flush_batch_size
+    for i in range(0, len(keys), size):
+        chunk = keys[i:i + size]
+        try:
+            # Read and write in one transaction so concurrent edits to other properties survive
+            with ds_client.transaction():
+                entities = ds_client.get_multi(chunk)
+                for entity in entities:
+                    entity.update(batch[entity.key])
+                ds_client.put_multi(entities)
+        except Exception:
+            logging.exception("write-behind flush failed; requeueing %d updates", len(keys) - i)
+            requeue({key: batch[key] for key in keys[i:]})
+            return
+    return len(keys)
+
+
+def run_flusher():
+    while True:
+        time.sleep(constants.login_flush_seconds)
+        flush()
+
+
+atexit.register(flush)